@@ -0,0 +1,263 @@
+import io
+import os
+import json
+import zlib
+import shutil
+import struct
+import tarfile
+import zipfile
+import argparse
+import subprocess
+
+import numpy as np
+import torch
+from sklearn import preprocessing
+
+import config
+import engine
+import manifest
+import train
+from dataset import ClassificationDataset
+from model import load_checkpoint
+
+INDEX_VERSION = 1
+
+# local extractors able to stream a single rar member to stdout, in order of preference
+RAR_TOOLS = {
+    "unrar": {"list": ["unrar", "lb"], "read": ["unrar", "p", "-inul"]},
+    "7z": {"list": ["7z", "l", "-ba", "-slt"], "read": ["7z", "x", "-so"]},
+    "bsdtar": {"list": ["bsdtar", "-tf"], "read": ["bsdtar", "-xOf"]},
+}
+
+
+def _archive_kind(archive_path):
+    with open(archive_path, "rb") as f:
+        magic = f.read(8)
+    if magic.startswith(b"Rar!\x1a\x07"):
+        return "rar"
+    if zipfile.is_zipfile(archive_path):
+        return "zip"
+    if tarfile.is_tarfile(archive_path):
+        return "tar"
+    raise ValueError(f"Unsupported archive format: {archive_path}")
+
+
+def _rar_tool():
+    for name in RAR_TOOLS:
+        if shutil.which(name) is not None:
+            return name
+    raise RuntimeError(f"Reading rar archives needs one of {list(RAR_TOOLS)} on the PATH.")
+
+
+class ArchiveReader:
+    def __init__(self, archive_path, index_path=None):
+        """
+        Random access to the members of a tar, zip or rar archive without
+        extracting it. A member offset index is built on first open and
+        stored next to the archive, so later opens skip the scan.
+        --------------------------------------------------------------
+        :param archive_path: Path of the archive.
+        :param index_path: Where to store the index, defaults to <archive>.index.json.
+        """
+        self.archive_path = archive_path
+        self.index_path = index_path or archive_path + ".index.json"
+        self.kind = _archive_kind(archive_path)
+        self.members = self._load_or_build_index()
+        self._file = None
+        self._zip = None
+        self._pid = None
+
+    def __getstate__(self):
+        # open handles are not shared with DataLoader workers, each reopens its own
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_zip"] = None
+        state["_pid"] = None
+        return state
+
+    def _archive_stamp(self):
+        stat = os.stat(self.archive_path)
+        return [stat.st_size, stat.st_mtime]
+
+    def _load_or_build_index(self):
+        if os.path.exists(self.index_path):
+            index = json.load(open(self.index_path, "r"))
+            if index.get("version") == INDEX_VERSION and index.get("stamp") == self._archive_stamp():
+                return index["members"]
+
+        members = getattr(self, f"_index_{self.kind}")()
+        index = {"version": INDEX_VERSION, "stamp": self._archive_stamp(), "members": members}
+        try:
+            with open(self.index_path, "w") as f:
+                json.dump(index, f)
+        except OSError:
+            # read-only location, keep the index in memory only
+            pass
+        return members
+
+    def _index_tar(self):
+        try:
+            archive = tarfile.open(self.archive_path, "r:")
+        except tarfile.ReadError:
+            raise ValueError("Compressed tar archives cannot be randomly accessed; use a plain .tar.")
+        with archive:
+            return {m.name: [m.offset_data, m.size] for m in archive if m.isfile()}
+
+    def _index_zip(self):
+        with zipfile.ZipFile(self.archive_path) as archive:
+            return {
+                info.filename: [info.header_offset, info.compress_size, info.compress_type]
+                for info in archive.infolist()
+                if not info.is_dir()
+            }
+
+    def _index_rar(self):
+        tool = _rar_tool()
+        output = subprocess.run(
+            RAR_TOOLS[tool]["list"] + [self.archive_path],
+            capture_output=True,
+            check=True,
+        ).stdout.decode("utf-8")
+        if tool == "7z":
+            names = [line[len("Path = "):] for line in output.splitlines() if line.startswith("Path = ")]
+        else:
+            names = [line for line in output.splitlines() if line and not line.endswith("/")]
+        # rar members are usually solid-compressed, so only names are indexed
+        return {name: None for name in names}
+
+    def _handle(self):
+        if self._pid != os.getpid():
+            self._file = open(self.archive_path, "rb")
+            self._zip = None
+            self._pid = os.getpid()
+        return self._file
+
+    def read(self, name):
+        """
+        :return: The bytes of one member.
+        """
+        entry = self.members[name]
+        if self.kind == "tar":
+            offset, size = entry
+            f = self._handle()
+            f.seek(offset)
+            return f.read(size)
+
+        if self.kind == "zip":
+            header_offset, compress_size, compress_type = entry
+            f = self._handle()
+            if compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                if self._zip is None:
+                    self._zip = zipfile.ZipFile(f)
+                return self._zip.read(name)
+            f.seek(header_offset)
+            # local file header: 30 fixed bytes, then the name and extra fields
+            header = struct.unpack("<IHHHHHIIIHH", f.read(30))
+            f.seek(header[9] + header[10], os.SEEK_CUR)
+            data = f.read(compress_size)
+            if compress_type == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(data, -15)
+            return data
+
+        return subprocess.run(
+            RAR_TOOLS[_rar_tool()]["read"] + [self.archive_path, name],
+            capture_output=True,
+            check=True,
+        ).stdout
+
+
+class ArchiveDataset(ClassificationDataset):
+    def __init__(
+        self,
+        archive_path,
+        classes,
+        resize=None,
+        input_mode="rgb",
+        labels_name="labels.json",
+        image_suffix=".png",
+        return_index=False,
+    ):
+        """
+        Streams labeled images straight out of an archive. Labels come from
+        a JSON member (file name -> label) inside the archive; images whose
+        label has characters outside classes are skipped.
+        --------------------------------------------------------------
+        :param archive_path: Path of a tar, zip or rar archive.
+        :param classes: Character classes of the model, e.g. a checkpoint's "classes".
+        :param resize: (height, width) the images are resized to.
+        :param input_mode: One of dataset.INPUT_MODES.
+        :param labels_name: File name of the label manifest inside the archive.
+        :param image_suffix: Suffix of the image members.
+        """
+        self.reader = ArchiveReader(archive_path)
+        labels_member = next(
+            (name for name in self.reader.members if os.path.basename(name) == labels_name), None
+        )
+        if labels_member is None:
+            raise ValueError(f"{archive_path} has no {labels_name} member with the labels.")
+        labels_dict = json.loads(self.reader.read(labels_member))
+
+        members, labels, encoded = [], [], []
+        self.skipped = 0
+        for name in sorted(self.reader.members):
+            label = labels_dict.get(os.path.basename(name))
+            if not name.endswith(image_suffix) or label is None:
+                continue
+            try:
+                encoded.append(manifest.encode_label(label, classes))
+            except ValueError:
+                self.skipped += 1
+                continue
+            members.append(name)
+            labels.append(label)
+        if self.skipped:
+            print(f"Skipping {self.skipped} images with characters outside the classes.")
+        if not members:
+            raise ValueError(
+                f"No usable images in {archive_path}: none are labeled {image_suffix} files "
+                f"with characters in the classes ({self.skipped} skipped)."
+            )
+
+        lengths = np.array([len(e) for e in encoded])
+        targets = np.zeros((len(encoded), lengths.max()), dtype=np.int64)
+        for i, e in enumerate(encoded):
+            targets[i, : len(e)] = e
+        self.labels = labels
+
+        super(ArchiveDataset, self).__init__(
+            image_paths=members,
+            targets=targets,
+            resize=resize,
+            target_lengths=lengths,
+            return_index=return_index,
+            input_mode=input_mode,
+        )
+
+    def _open(self, item):
+        return io.BytesIO(self.reader.read(self.image_paths[item]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a checkpoint on an archived test set.")
+    parser.add_argument("archive")
+    parser.add_argument("--model", default=config.MODEL_PATH)
+    parser.add_argument("--batch-size", type=int, default=config.BATCH_SIZE)
+    parser.add_argument("--num-workers", type=int, default=config.NUM_WORKERS)
+    args = parser.parse_args()
+
+    model, checkpoint = load_checkpoint(args.model)
+    model.to(config.DEVICE)
+    data = ArchiveDataset(
+        args.archive,
+        checkpoint["classes"],
+        resize=model.config["input_size"],
+        input_mode=checkpoint["input_mode"],
+    )
+    loader = torch.utils.data.DataLoader(
+        data, batch_size=args.batch_size, num_workers=args.num_workers, shuffle=False
+    )
+    encoder = preprocessing.LabelEncoder()
+    encoder.classes_ = np.array(checkpoint["classes"])
+    valid_preds, test_loss = engine.eval_fn(model, loader)
+    accuracy, _ = train.captcha_accuracy(valid_preds, data.labels, encoder)
+    print(f"Images={len(data)}, Skipped={data.skipped}, Test Loss={test_loss} Accuracy={accuracy}")
@@ -0,0 +1,182 @@
+import io
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+def content_key(image_bytes):
+    return "sha256:" + hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_key(image_bytes, hash_size=16):
+    """
+    Difference hash: the sign of horizontal gradients of a downscaled
+    grayscale copy. Re-encoded or lightly altered copies of an image share it.
+    """
+    image = Image.open(io.BytesIO(image_bytes)).convert("L")
+    image = image.resize((hash_size + 1, hash_size), resample=Image.BILINEAR)
+    pixels = np.array(image, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return "dhash:" + np.packbits(bits).tobytes().hex()
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_size=10000,
+        ttl=None,
+        persist_path=None,
+        perceptual=False,
+        hash_size=16,
+        fingerprint=None,
+    ):
+        """
+        Bounded LRU cache of solved captchas keyed by a hash of the image bytes.
+        Results are only valid for the model that produced them: the cache is
+        tagged with that model's fingerprint and emptied, on disk too, when
+        bound to a different one (see bind).
+        --------------------------------------------------------------
+        :param max_size: Maximum number of cached images before the least recently used is evicted.
+        :param ttl: Seconds an entry stays valid, None to never expire.
+        :param persist_path: Optional SQLite file the cache is written through to and reloaded from.
+        :param perceptual: Also index entries by a perceptual hash to catch near-duplicates.
+        :param hash_size: Side of the perceptual hash grid.
+        :param fingerprint: Identity of the model whose results are cached, None to
+                            adopt the one stored in persist_path.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.perceptual = perceptual
+        self.hash_size = hash_size
+        self.fingerprint = fingerprint
+        self._entries = OrderedDict()  # content key -> (text, confidence, stored_at, perceptual key)
+        self._perceptual_index = {}  # perceptual key -> content key
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._db = None
+        if persist_path is not None:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, perceptual_key TEXT, text TEXT, confidence REAL, stored_at REAL)"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            row = self._db.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+            stored = row[0] if row is not None else None
+            if fingerprint is None:
+                self.fingerprint = stored
+            elif fingerprint != stored:
+                self._reset_store()
+            self._db.commit()
+            self._load()
+
+    def _reset_store(self):
+        self._db.execute("DELETE FROM entries")
+        self._db.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (self.fingerprint,)
+        )
+
+    def bind(self, fingerprint):
+        """
+        Ties the cache to a model. Cached results of any other model are dropped.
+        """
+        with self._lock:
+            if fingerprint == self.fingerprint:
+                return
+            self.fingerprint = fingerprint
+            self._entries.clear()
+            self._perceptual_index.clear()
+            if self._db is not None:
+                self._reset_store()
+                self._db.commit()
+
+    def _load(self):
+        rows = self._db.execute(
+            "SELECT key, perceptual_key, text, confidence, stored_at FROM entries "
+            "ORDER BY stored_at DESC LIMIT ?",
+            (self.max_size,),
+        ).fetchall()
+        for key, perceptual, text, confidence, stored_at in reversed(rows):
+            if not self._expired(stored_at):
+                self._insert(key, perceptual, text, confidence, stored_at)
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _insert(self, key, perceptual, text, confidence, stored_at):
+        self._entries[key] = (text, confidence, stored_at, perceptual)
+        self._entries.move_to_end(key)
+        if perceptual is not None:
+            # the most recent image with this perceptual hash answers for it
+            self._perceptual_index[perceptual] = key
+
+    def _delete(self, key):
+        perceptual = self._entries.pop(key)[3]
+        if perceptual is not None and self._perceptual_index.get(perceptual) == key:
+            del self._perceptual_index[perceptual]
+        if self._db is not None:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def get(self, image_bytes):
+        """
+        :return: The cached (text, confidence) or None.
+        """
+        key = content_key(image_bytes)
+        with self._lock:
+            if key not in self._entries and self.perceptual:
+                key = self._perceptual_index.get(perceptual_key(image_bytes, self.hash_size), key)
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[2]):
+                self._delete(key)
+                self.expirations += 1
+                if self._db is not None:
+                    self._db.commit()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, image_bytes, text, confidence):
+        stored_at = time.time()
+        key = content_key(image_bytes)
+        perceptual = perceptual_key(image_bytes, self.hash_size) if self.perceptual else None
+        with self._lock:
+            if key in self._entries:
+                self._delete(key)
+            self._insert(key, perceptual, text, confidence, stored_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                    (key, perceptual, text, confidence, stored_at),
+                )
+            while len(self._entries) > self.max_size:
+                self._delete(next(iter(self._entries)))
+                self.evictions += 1
+            if self._db is not None:
+                self._db.commit()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
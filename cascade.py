@@ -0,0 +1,74 @@
+import time
+import argparse
+
+import config
+import train
+from inference import CaptchaSolver, CascadeSolver
+from train import remove_duplicates
+
+
+def evaluate_solver(solver, records, batch_size=32):
+    """
+    :return: (accuracy, images per second) of solving the records end to end,
+             including image decoding and preprocessing.
+    """
+    image_paths = [r["path"] for r in records]
+    predictions = []
+    start = time.perf_counter()
+    for i in range(0, len(image_paths), batch_size):
+        predictions.extend(solver.solve_batch(image_paths[i : i + batch_size]))
+    elapsed = time.perf_counter() - start
+
+    correct = sum(
+        text == remove_duplicates(r["label"]) for (text, _), r in zip(predictions, records)
+    )
+    return correct / len(records), len(records) / elapsed
+
+
+def evaluate_cascade(fast_path, full_path, thresholds, beam_width=0, quantize=True):
+    """
+    Compares always running the full model against the cascade at every
+    confidence threshold on the manifest's test split.
+    """
+    _, _, test_records = train.load_manifest_splits()
+    fast = CaptchaSolver(fast_path, quantize=quantize)
+    full = CaptchaSolver(full_path)
+
+    accuracy, throughput = evaluate_solver(full, test_records)
+    report = [{"mode": "full", "escalation_rate": 1.0, "accuracy": accuracy, "images_per_sec": throughput}]
+    for threshold in thresholds:
+        cascade = CascadeSolver(fast, full, threshold=threshold, beam_width=beam_width)
+        accuracy, throughput = evaluate_solver(cascade, test_records)
+        report.append(
+            {
+                "mode": f"cascade@{threshold}",
+                "escalation_rate": cascade.escalation_rate,
+                "accuracy": accuracy,
+                "images_per_sec": throughput,
+            }
+        )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate confidence-gated cascade inference.")
+    parser.add_argument("--fast", required=True, help="checkpoint of the small model")
+    parser.add_argument("--full", default=config.MODEL_PATH)
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[0.5, 0.8, 0.9, 0.99])
+    parser.add_argument("--beam-width", type=int, default=0)
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+
+    report = evaluate_cascade(
+        args.fast,
+        args.full,
+        args.thresholds,
+        beam_width=args.beam_width,
+        quantize=not args.no_quantize,
+    )
+    print(f"{'mode':<16}{'escalated':>10}{'accuracy':>10}{'img/s':>10}")
+    for r in report:
+        print(
+            f"{r['mode']:<16}{r['escalation_rate']:>10.2%}"
+            f"{r['accuracy']:>10.4f}{r['images_per_sec']:>10.1f}"
+        )
@@ -5,4 +5,15 @@ IMAGE_WIDTH = 160
 IMAGE_HEIGHT = 50
 NUM_WORKERS = 8
 EPOCHS = 200
-DEVICE = "cuda"
\ No newline at end of file
+DEVICE = "cuda"
+MANIFEST_PATH = "data/train_set/manifest.jsonl"
+TEST_SIZE = 0.1
+MODEL_VARIANT = "base"
+MODEL_PATH = "captcha_model.pt"
+# "rgb", "gray" or "min", see dataset.INPUT_MODES
+INPUT_MODE = "rgb"
+# decode every image once into memory instead of on every access
+PRELOAD_IMAGES = False
+# DataLoader settings written by loader_tuning.py; run_training tunes once when enabled
+LOADER_CONFIG_PATH = "loader_config.json"
+AUTOTUNE_LOADER = False
@@ -0,0 +1,179 @@
+import io
+import time
+import hashlib
+import argparse
+import resource
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image
+from captcha_synthesis import CaptchaSynthesis, BACKENDS
+from main import EXECUTORS
+
+
+def throughput(synthesizer, num_images, warmup=10):
+    """
+    Measures how many captchas per second a synthesizer produces.
+    --------------------------------------------------------------
+    :param synthesizer: A CaptchaSynthesis instance.
+    :param num_images: Number of captchas to time.
+    :param warmup: Untimed captchas generated first (file listing, buffer setup).
+    :return: images per second
+    """
+
+    for _ in range(warmup):
+        synthesizer.synthesize_captcha()
+
+    start = time.perf_counter()
+    for _ in range(num_images):
+        synthesizer.synthesize_captcha()
+    return num_images / (time.perf_counter() - start)
+
+
+def allocations(synthesizer, num_images):
+    """
+    Counts the memory allocated while synthesizing. PIL allocates image
+    memory outside the Python allocator, so its images are counted through
+    the imaging core statistics, and NumPy/Python memory through tracemalloc.
+    --------------------------------------------------------------
+    :param synthesizer: A CaptchaSynthesis instance.
+    :param num_images: Number of captchas to synthesize.
+    :return: (PIL images created per captcha, peak traced bytes)
+    """
+
+    # warm up once so one-time buffers are not attributed to every captcha
+    synthesizer.synthesize_captcha()
+
+    pil_images = Image.core.get_stats()["new_count"]
+    tracemalloc.start()
+    for _ in range(num_images):
+        synthesizer.synthesize_captcha()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    pil_images = Image.core.get_stats()["new_count"] - pil_images
+
+    return pil_images / num_images, peak
+
+
+def benchmark_backends(backends=BACKENDS, num_images=500, seed=0):
+    """
+    Compares the synthesis backends on throughput and allocations.
+    --------------------------------------------------------------
+    :param backends: Backends of CaptchaSynthesis to compare.
+    :param num_images: Number of captchas per measurement.
+    :param seed: Root seed of the synthesizers.
+    :return: list of result dicts
+    """
+
+    results = []
+    for backend in backends:
+        synthesizer = CaptchaSynthesis(backend=backend, seed=seed)
+        images_per_sec = throughput(synthesizer, num_images)
+        pil_images, peak = allocations(synthesizer, max(num_images // 10, 1))
+        results.append({
+            "backend": backend,
+            "images_per_sec": images_per_sec,
+            "pil_images_per_captcha": pil_images,
+            "peak_traced_kb": peak / 1024,
+        })
+
+    return results
+
+
+def _synthesize_shard(worker_id, num_items, backend, seed):
+    # what a data/main.py worker does, with the PNGs encoded in memory instead of written
+    synthesizer = CaptchaSynthesis(backend=backend, seed=seed)
+    digests = []
+    for n in range(num_items):
+        index = worker_id * num_items + n
+        image, label = synthesizer.synthesize_captcha(index=index)
+        image.save(io.BytesIO(), format="PNG")
+        digests.append((index, hashlib.md5(image.tobytes() + "".join(label).encode()).hexdigest()))
+    return digests, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_executor(executor, num_workers, num_images, backend, seed):
+    pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    per_worker = max(num_images // num_workers, 1)
+    start = time.perf_counter()
+    with pool_class(num_workers) as pool:
+        shards = list(pool.map(
+            _synthesize_shard,
+            range(num_workers),
+            [per_worker] * num_workers,
+            [backend] * num_workers,
+            [seed] * num_workers,
+        ))
+    elapsed = time.perf_counter() - start
+
+    # threads report the peak of this process; worker processes add their own peaks
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if executor == "process":
+        peak_kb += sum(rss for _, rss in shards)
+
+    digests = sorted(d for shard, _ in shards for d in shard)
+    output_digest = hashlib.md5("".join(d for _, d in digests).encode()).hexdigest()
+    return per_worker * num_workers / elapsed, peak_kb / 1024, output_digest
+
+
+def benchmark_executors(executors=EXECUTORS, num_workers=4, num_images=500, backend="pil", seed=0):
+    """
+    Compares the thread and process generator backends of data/main.py on
+    throughput and peak resident memory. Every run starts in a fresh
+    interpreter so earlier runs do not inflate its peak; for processes the
+    peaks of the workers are summed, which counts copy-on-write pages
+    shared with the parent once per worker.
+    --------------------------------------------------------------
+    :param executors: Executors to compare.
+    :param num_workers: Number of threads or processes.
+    :param num_images: Number of captchas per run.
+    :param backend: Backend of CaptchaSynthesis.
+    :param seed: Root seed; runs with the same seed must produce the same captchas.
+    :return: list of result dicts
+    """
+
+    results = []
+    for executor in executors:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as runner:
+            images_per_sec, peak_mb, output_digest = runner.submit(
+                _run_executor, executor, num_workers, num_images, backend, seed
+            ).result()
+        results.append({
+            "executor": executor,
+            "images_per_sec": images_per_sec,
+            "peak_rss_mb": peak_mb,
+            "output_digest": output_digest,
+        })
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the captcha synthesis backends.")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--num-images", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--executors", action="store_true",
+                        help="compare the thread and process generators of main.py instead")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.executors:
+        for backend in args.backends:
+            results = benchmark_executors(EXECUTORS, args.workers, args.num_images, backend, args.seed)
+            print(f"backend={backend}, workers={args.workers}")
+            print(f"{'executor':<10}{'img/s':>10}{'peak RSS MB':>14}")
+            for r in results:
+                print(f"{r['executor']:<10}{r['images_per_sec']:>10.1f}{r['peak_rss_mb']:>14.1f}")
+            same = len({r["output_digest"] for r in results}) == 1
+            print(f"identical captchas across executors: {same}")
+    else:
+        results = benchmark_backends(args.backends, args.num_images, args.seed)
+        print(f"{'backend':<10}{'img/s':>10}{'PIL imgs/captcha':>18}{'peak traced KB*':>17}")
+        for r in results:
+            print(
+                f"{r['backend']:<10}{r['images_per_sec']:>10.1f}"
+                f"{r['pil_images_per_captcha']:>18.1f}{r['peak_traced_kb']:>17.1f}"
+            )
+        print("* NumPy/Python memory only, PIL image buffers are counted in the PIL column")
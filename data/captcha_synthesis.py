@@ -6,12 +6,31 @@ import numpy as np
 
 # random.seed(12)
 
+def make_rngs(seed_sequence):
+    """
+    Builds the random generators of one stream of the seed tree: a
+    random.Random for scalar draws and a NumPy Generator for array draws.
+    --------------------------------------------------------------
+    :param seed_sequence: A np.random.SeedSequence.
+    :return: (random.Random, np.random.Generator)
+    """
+
+    # the NumPy generator is seeded from the first four state words, random.Random from the next four
+    state = seed_sequence.generate_state(8, np.uint64)
+    return random.Random(int.from_bytes(state[4:].tobytes(), 'little')), np.random.default_rng(seed_sequence)
+
 class Sampler:
     def __init__(
         self, 
-        root_dir="mnist_chars/"
+        root_dir="mnist_chars/",
+        rng=None
     ):
+        """
+        :param root_dir: Root directory containing character subfolders.
+        :param rng: A random.Random, a fresh unseeded one by default.
+        """
         self.root_dir = root_dir
+        self.rng = rng if rng is not None else random.Random()
     
     def get_stroke_bounding_box(self, image):
         """
@@ -50,13 +69,13 @@ class Sampler:
                 continue
 
             # List all PNG images in the directory
-            images = [file for file in os.listdir(char_dir) if file.endswith('.png')]
+            images = sorted(file for file in os.listdir(char_dir) if file.endswith('.png'))
             if not images:
                 print(f"No images found for {character}. Skipping...")
                 continue
 
             # Sample k images from the list
-            sampled_filenames = random.sample(images, k=min(k, len(images)))
+            sampled_filenames = self.rng.sample(images, k=min(k, len(images)))
 
             # Load and add the sampled images to the list
             for filename in sampled_filenames:
@@ -84,9 +103,9 @@ class Sampler:
         # if is white, resample
         colors = []
         for _ in range(num_colors):
-            color = tuple(random.randint(0, 255) for _ in range(3))
+            color = tuple(self.rng.randint(0, 255) for _ in range(3))
             while color == (255, 255, 255):
-                color = tuple(random.randint(0, 255) for _ in range(3))
+                color = tuple(self.rng.randint(0, 255) for _ in range(3))
             colors.append(color)
 
         return colors
@@ -103,13 +122,14 @@ class Sampler:
         :output: characters
         """
         char_set = [char for char in string.ascii_uppercase if char not in exclude_chars]
-        characters = random.choices(char_set, k=num_chars)
+        characters = self.rng.choices(char_set, k=num_chars)
         return characters
 
 class CanvasSynthesis:
     def __init__(
         self,
-        canvas: Image=None
+        canvas: Image=None,
+        rng=None
     ):
         """
         This is the constructor method for the CanvasSynthesis class.
@@ -117,10 +137,12 @@ class CanvasSynthesis:
         Note: the canvas is not transformed in place, but rather a new canvas is returned.
         --------------------------------------------------------------
         :param canvas: A PIL Image object representing the canvas.
+        :param rng: A random.Random, a fresh unseeded one by default.
         :output: None
         """
 
         self.canvas = canvas
+        self.rng = rng if rng is not None else random.Random()
         if self.canvas is not None:
             self.canvas_size = (self.canvas.width, self.canvas.height)
     
@@ -163,11 +185,11 @@ class CanvasSynthesis:
         # Apply noise to a random selection of pixels
         for _ in range(noise_pixels):
             # Randomly choose a pixel
-            x = random.randint(0, canvas_array.shape[0] - 1)
-            y = random.randint(0, canvas_array.shape[1] - 1)
+            x = self.rng.randint(0, canvas_array.shape[0] - 1)
+            y = self.rng.randint(0, canvas_array.shape[1] - 1)
 
             # Generate random RGB values for noise
-            noise_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255), 255)
+            noise_color = (self.rng.randint(0, 255), self.rng.randint(0, 255), self.rng.randint(0, 255), 255)
 
             # Apply the noise
             canvas_array[x, y] = noise_color
@@ -194,15 +216,15 @@ class CanvasSynthesis:
 
         # Prepare to draw on the image
         draw = ImageDraw.Draw(self.canvas)
-        num_lines = random.randint(*num_line_range)
+        num_lines = self.rng.randint(*num_line_range)
 
         for _ in range(num_lines):
             # Randomly choose line coordinates
-            x1, y1 = random.randint(0, self.canvas.width - 1), random.randint(0, self.canvas.height - 1)
-            x2, y2 = random.randint(0, self.canvas.width - 1), random.randint(0, self.canvas.height - 1)
+            x1, y1 = self.rng.randint(0, self.canvas.width - 1), self.rng.randint(0, self.canvas.height - 1)
+            x2, y2 = self.rng.randint(0, self.canvas.width - 1), self.rng.randint(0, self.canvas.height - 1)
 
             # Generate a random RGB color for the line
-            line_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+            line_color = (self.rng.randint(0, 255), self.rng.randint(0, 255), self.rng.randint(0, 255))
 
             # Draw the line
             draw.line([x1, y1, x2, y2], fill=line_color, width=width)
@@ -224,13 +246,13 @@ class CanvasSynthesis:
         """
 
         draw = ImageDraw.Draw(self.canvas)
-        num_circles = random.randint(*num_circle_range)
+        num_circles = self.rng.randint(*num_circle_range)
 
         for _ in range(num_circles):
             # Randomly choose the center and diameter for each circle
-            center_x = random.randint(0, self.canvas.width)
-            center_y = random.randint(0, self.canvas.height)
-            diameter = random.randint(*circle_diameter_range)
+            center_x = self.rng.randint(0, self.canvas.width)
+            center_y = self.rng.randint(0, self.canvas.height)
+            diameter = self.rng.randint(*circle_diameter_range)
 
             # Calculate the bounding box for the circle
             left = center_x - diameter // 2
@@ -239,7 +261,7 @@ class CanvasSynthesis:
             bottom = center_y + diameter // 2
 
             # Generate a random RGB color for the circle
-            circle_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+            circle_color = (self.rng.randint(0, 255), self.rng.randint(0, 255), self.rng.randint(0, 255))
 
             # Draw the circle
             draw.ellipse([left, top, right, bottom], outline=circle_color, width=width)
@@ -294,27 +316,27 @@ class CanvasSynthesis:
         """
 
         # Initial X position (will be updated after placing each character)
-        x_offset = random.randint(x_offset_range[1]//2, x_offset_range[1]*2)
+        x_offset = self.rng.randint(x_offset_range[1]//2, x_offset_range[1]*2)
 
         for i, char_img in enumerate(characters):
             # Randomly adjust the scale
-            scale_factor = random.uniform(*scale_range)
+            scale_factor = self.rng.uniform(*scale_range)
             new_size = (int(char_img.width * scale_factor), int(char_img.height * scale_factor))
             char_img_resized = char_img.resize(new_size, Image.LANCZOS)
 
             # Randomly adjust the rotation angle
-            angle = random.uniform(*rotate_range)
+            angle = self.rng.uniform(*rotate_range)
             char_img_rotated = char_img_resized.rotate(angle, expand=1, fillcolor=(255,255,255,0))
 
             # Randomly adjust the Y position for vertical variation, within canvas limits
             max_y_variation = self.canvas_size[1] - char_img_rotated.height
-            y_offset = random.randint(0, max(max_y_variation, 1))
+            y_offset = self.rng.randint(0, max(max_y_variation, 1))
 
             # Composite the character onto the canvas
             self.canvas.paste(char_img_rotated, (x_offset, y_offset), char_img_rotated)
 
             # Update x_offset for the next character, allowing for some overlap
-            x_offset += char_img_rotated.width - random.randint(*x_offset_range)  # Adjust overlap
+            x_offset += char_img_rotated.width - self.rng.randint(*x_offset_range)  # Adjust overlap
 
             # Break if we run out of space on the canvas
             if i != len(characters)-1 and x_offset >= self.canvas_size[0] - char_img_rotated.width:
@@ -327,13 +349,350 @@ class CanvasSynthesis:
 
         return self.canvas
 
+class ArrayCanvasSynthesis:
+    def __init__(
+        self,
+        canvas_size=(160, 50),
+        color=(255, 255, 255),
+        alpha=255,
+        rng=None,
+        np_rng=None
+    ):
+        """
+        NumPy counterpart of CanvasSynthesis. The canvas stays a single
+        preallocated (height, width, 4) uint8 buffer for the whole pipeline:
+        glyphs are alpha-composited into it in place and noise is written
+        with vectorized indexing. It is converted to a PIL image only once,
+        by to_image.
+        --------------------------------------------------------------
+        :param canvas_size: Tuple of the canvas size (width, height).
+        :param color: Tuple of the RGB background color.
+        :param alpha: The alpha value of the background.
+        :param rng: A random.Random, a fresh unseeded one by default.
+        :param np_rng: A np.random.Generator, a fresh unseeded one by default.
+        :output: None
+        """
+
+        self.rng = rng if rng is not None else random.Random()
+        self.np_rng = np_rng if np_rng is not None else np.random.default_rng()
+        self.canvas = None
+        self._scratch = None
+        self(canvas_size, color, alpha)
+
+    def __call__(
+        self,
+        canvas_size=(160, 50),
+        color=(255, 255, 255),
+        alpha=255
+    ):
+        """
+        This method resets the canvas to a blank background, reusing the
+        buffers unless the size changes.
+        --------------------------------------------------------------
+        :param canvas_size: Tuple of the canvas size (width, height).
+        :param color: Tuple of the RGB background color.
+        :param alpha: The alpha value of the background.
+        :output: None
+        """
+
+        shape = (canvas_size[1], canvas_size[0], 4)
+        if self.canvas is None or self.canvas.shape != shape:
+            self.canvas = np.empty(shape, dtype=np.uint8)
+            # float work area for blending, so compositing allocates no canvas-sized arrays
+            self._scratch = np.empty(shape, dtype=np.float32)
+        self.canvas[...] = (*color, alpha)
+        self.canvas_size = canvas_size
+
+    def to_image(self):
+        """
+        Copies the buffer into a PIL image; the buffer is reused by the next captcha.
+        --------------------------------------------------------------
+        :return: A PIL Image object in RGBA mode.
+        """
+
+        return Image.fromarray(self.canvas.copy(), 'RGBA')
+
+    def _blend(self, alpha, color, x, y):
+        """
+        Composites a single-color glyph onto the canvas in place, with the blend
+        of Image.paste(glyph, (x, y), glyph). The result is visually equivalent to,
+        not identical with, the PIL backend: there the RGBA glyph is resized on
+        premultiplied alpha, which shifts edge colors by a few levels, while
+        here the color stays constant and only the alpha mask is resized.
+        --------------------------------------------------------------
+        :param alpha: A (height, width) uint8 array with the glyph alpha.
+        :param color: Tuple of the RGB glyph color.
+        :param x: Left position on the canvas.
+        :param y: Top position on the canvas.
+        """
+
+        height, width = alpha.shape
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.canvas.shape[1]), min(y + height, self.canvas.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        glyph_alpha = alpha[y0 - y:y1 - y, x0 - x:x1 - x]
+        region = self.canvas[y0:y1, x0:x1]
+        work = self._scratch[y0:y1, x0:x1]
+
+        # dst = dst + (src - dst) * mask, with the glyph alpha as both src alpha and mask
+        work[..., :3] = color
+        work[..., 3] = glyph_alpha
+        work -= region
+        work *= glyph_alpha[..., None] / 255.0
+        work += region
+        work += 0.5
+        region[...] = work
+
+    def _add_pixel_noise_to_canvas(
+        self,
+        noise_density=0.05,
+    ):
+        """
+        Adds random pixel noise to the canvas.
+        --------------------------------------------------------------
+        :param noise_density: The density of noise to add.
+        :return: The canvas buffer.
+        """
+
+        height, width = self.canvas.shape[:2]
+        noise_pixels = int(height * width * noise_density)
+
+        rows = self.np_rng.integers(0, height, size=noise_pixels)
+        cols = self.np_rng.integers(0, width, size=noise_pixels)
+        self.canvas[rows, cols, :3] = self.np_rng.integers(0, 256, size=(noise_pixels, 3))
+        self.canvas[rows, cols, 3] = 255
+
+        return self.canvas
+
+    def _draw_points(self, points, width=1):
+        """
+        Paints all strokes with a single scatter into the canvas.
+        --------------------------------------------------------------
+        :param points: List of (xs, ys, color) strokes, in drawing order.
+        :param width: Strokes are thickened to a width x width square.
+        """
+
+        xs = np.concatenate([p[0] for p in points])
+        ys = np.concatenate([p[1] for p in points])
+        colors = np.repeat(
+            np.array([(*p[2], 255) for p in points], dtype=np.uint8),
+            [len(p[0]) for p in points],
+            axis=0
+        )
+
+        offsets = np.arange(width) - (width - 1) // 2
+        dx, dy = np.meshgrid(offsets, offsets)
+        xs = (xs[:, None] + dx.ravel()).ravel()
+        ys = (ys[:, None] + dy.ravel()).ravel()
+        colors = np.repeat(colors, width * width, axis=0)
+
+        inside = (xs >= 0) & (xs < self.canvas.shape[1]) & (ys >= 0) & (ys < self.canvas.shape[0])
+        self.canvas[ys[inside], xs[inside]] = colors[inside]
+
+    def _add_line_noise_to_canvas(
+        self,
+        num_line_range=(3, 8),
+        width=1
+    ):
+        """
+        Adds random lines to the canvas.
+        --------------------------------------------------------------
+        :param num_line_range: A tuple specifying the range of the number of lines to add.
+        :return: The canvas buffer.
+        """
+
+        canvas_width, canvas_height = self.canvas_size
+        num_lines = self.rng.randint(*num_line_range)
+
+        points = []
+        for _ in range(num_lines):
+            # Randomly choose line coordinates
+            x1, y1 = self.rng.randint(0, canvas_width - 1), self.rng.randint(0, canvas_height - 1)
+            x2, y2 = self.rng.randint(0, canvas_width - 1), self.rng.randint(0, canvas_height - 1)
+
+            # Generate a random RGB color for the line
+            line_color = (self.rng.randint(0, 255), self.rng.randint(0, 255), self.rng.randint(0, 255))
+
+            # Rasterize with one sample per pixel along the major axis
+            steps = max(abs(x2 - x1), abs(y2 - y1)) + 1
+            xs = np.rint(np.linspace(x1, x2, steps)).astype(np.int64)
+            ys = np.rint(np.linspace(y1, y2, steps)).astype(np.int64)
+            points.append((xs, ys, line_color))
+
+        if points:
+            self._draw_points(points, width)
+
+        return self.canvas
+
+    def _add_circle_noise_to_canvas(
+        self,
+        num_circle_range=(3, 8),
+        circle_diameter_range=(5, 20),
+        width=1
+    ):
+        """
+        Adds random circles to the canvas.
+        --------------------------------------------------------------
+        :param num_circle_range: A tuple specifying the range of the number of circles to add.
+        :param circle_diameter_range: A tuple specifying the range of diameters for the circles.
+        :return: The canvas buffer.
+        """
+
+        canvas_width, canvas_height = self.canvas_size
+        num_circles = self.rng.randint(*num_circle_range)
+
+        points = []
+        for _ in range(num_circles):
+            # Randomly choose the center and diameter for each circle
+            center_x = self.rng.randint(0, canvas_width)
+            center_y = self.rng.randint(0, canvas_height)
+            diameter = self.rng.randint(*circle_diameter_range)
+
+            # Generate a random RGB color for the circle
+            circle_color = (self.rng.randint(0, 255), self.rng.randint(0, 255), self.rng.randint(0, 255))
+
+            # Sample the outline densely enough to leave no gaps
+            radius = diameter / 2
+            angles = np.linspace(0, 2 * np.pi, max(int(np.ceil(2 * np.pi * radius)) * 2, 8), endpoint=False)
+            xs = np.rint(center_x + radius * np.cos(angles)).astype(np.int64)
+            ys = np.rint(center_y + radius * np.sin(angles)).astype(np.int64)
+            points.append((xs, ys, circle_color))
+
+        if points:
+            self._draw_points(points, width)
+
+        return self.canvas
+
+    def add_noise_to_canvas(
+        self,
+        noise_density=0.05,
+        num_line_range=(3, 8),
+        num_circle_range=(3, 8),
+        circle_diameter_range=(5, 20),
+        width=1
+    ):
+        """
+        Adds random noise to the canvas in the form of random pixels,
+        lines and circles.
+        --------------------------------------------------------------
+        :param noise_density: The density of noise to add.
+        :param num_line_range: A tuple specifying the range of the number of lines to add.
+        :param num_circle_range: A tuple specifying the range of the number of circles to add.
+        :param circle_diameter_range: A tuple specifying the range of diameters for the circles.
+        :return: The canvas buffer.
+        """
+
+        self._add_pixel_noise_to_canvas(noise_density=noise_density)
+        self._add_line_noise_to_canvas(num_line_range=num_line_range, width=width)
+        self._add_circle_noise_to_canvas(
+            num_circle_range=num_circle_range,
+            circle_diameter_range=circle_diameter_range,
+            width=width
+        )
+
+        return self.canvas
+
+    def add_characters_to_canvas(
+        self,
+        characters: list,
+        rotate_range=(-15, 15),
+        scale_range=(0.8, 1.2),
+        x_offset_range=(-20,0),
+    ):
+        """
+        Places characters on the canvas with variations.
+        --------------------------------------------------------------
+        :param characters: List of (alpha, color) pairs, alpha being a PIL Image in mode 'L'.
+        :param rotate_angle: Tuple of the range of rotation angles in degrees.
+        :param scale_range: Tuple of the range of scale factors.
+        :param x_offset_range: Tuple of the range of x-axis offsets.
+        :return: The canvas buffer.
+        """
+
+        # Initial X position (will be updated after placing each character)
+        x_offset = self.rng.randint(x_offset_range[1]//2, x_offset_range[1]*2)
+
+        for i, (char_alpha, color) in enumerate(characters):
+            # Randomly adjust the scale
+            scale_factor = self.rng.uniform(*scale_range)
+            new_size = (int(char_alpha.width * scale_factor), int(char_alpha.height * scale_factor))
+            char_alpha_resized = char_alpha.resize(new_size, Image.LANCZOS)
+
+            # Randomly adjust the rotation angle; only the alpha mask is transformed
+            angle = self.rng.uniform(*rotate_range)
+            char_alpha_rotated = char_alpha_resized.rotate(angle, expand=1, fillcolor=0)
+
+            # Randomly adjust the Y position for vertical variation, within canvas limits
+            max_y_variation = self.canvas_size[1] - char_alpha_rotated.height
+            y_offset = self.rng.randint(0, max(max_y_variation, 1))
+
+            # Composite the character into the canvas buffer
+            self._blend(np.asarray(char_alpha_rotated), color, x_offset, y_offset)
+
+            # Update x_offset for the next character, allowing for some overlap
+            x_offset += char_alpha_rotated.width - self.rng.randint(*x_offset_range)  # Adjust overlap
+
+            # Break if we run out of space on the canvas
+            if i != len(characters)-1 and x_offset >= self.canvas_size[0] - char_alpha_rotated.width:
+                # pop the characters that were not placed on the canvas
+                for _ in range(i+1, len(characters)):
+                    characters.pop()
+
+                break
+
+        return self.canvas
+
+BACKENDS = ("pil", "numpy")
+
 class CaptchaSynthesis:
     def __init__(
         self, 
-        root_dir="mnist_chars/"
+        root_dir="mnist_chars/",
+        backend="pil",
+        seed=None
     ):
+        """
+        All randomness comes from generators owned by the instance, so separate
+        instances can run in parallel threads. They are seeded from a
+        np.random.SeedSequence tree: the root seeds the default stream and
+        child i seeds captcha i, so synthesize_captcha(index=i) gives the same
+        captcha for the same (seed, i) in any worker and in any order.
+        --------------------------------------------------------------
+        :param root_dir: Root directory containing character subfolders.
+        :param backend: "pil" composites with PIL images, "numpy" keeps the
+                        canvas in a single preallocated array (ArrayCanvasSynthesis).
+        :param seed: Root seed, fresh OS entropy when None (kept in self.seed).
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}.")
+
+        self.backend = backend
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.seed = self.seed_sequence.entropy
         self.sampler = Sampler(root_dir)
-        self.cas = CanvasSynthesis()
+        self.cas = CanvasSynthesis() if backend == "pil" else ArrayCanvasSynthesis()
+        self.set_rngs(*make_rngs(self.seed_sequence))
+
+    def set_rngs(
+        self,
+        rng,
+        np_rng
+    ):
+        """
+        Shares one pair of generators between the synthesizer, its sampler and its canvas.
+        --------------------------------------------------------------
+        :param rng: A random.Random.
+        :param np_rng: A np.random.Generator.
+        :output: None
+        """
+
+        self.rng = rng
+        self.np_rng = np_rng
+        self.sampler.rng = rng
+        self.cas.rng = rng
+        self.cas.np_rng = np_rng
     
     def colorize_image(
         self, 
@@ -374,6 +733,26 @@ class CaptchaSynthesis:
         new_img = Image.fromarray(rgba_data, 'RGBA')
 
         return new_img
+
+    def glyph_alpha(
+        self,
+        grayscale_img,
+        alpha_percent=0.65
+    ):
+        """
+        The alpha mask colorize_image would give the character, for the numpy
+        backend which blends the color itself instead of building an RGBA image.
+        --------------------------------------------------------------
+        :param: grayscale_img
+        :param: alpha_percent
+        :output: alpha image in mode 'L'
+        """
+
+        if grayscale_img.mode != 'L':
+            raise ValueError("Image must be in grayscale mode ('L').")
+
+        gray_data = np.asarray(grayscale_img)
+        return Image.fromarray(((255 - gray_data)*alpha_percent).astype(np.uint8), 'L')
     
     def create_canvas(
         self, 
@@ -406,7 +785,8 @@ class CaptchaSynthesis:
         canvas_size=(160, 50),
         background_alpha=255,
         background_color=(255, 255, 255),
-        brush_width=1
+        brush_width=1,
+        index=None
     ):
         """
         This method synthesizes a captcha image with the specified number of characters.
@@ -416,23 +796,35 @@ class CaptchaSynthesis:
         :param rotate_range: Tuple of the range of rotation angles in degrees.
         :param scale_range: Tuple of the range of scale factors.
         :param x_offset_range: Tuple of the range of x-axis offsets.
+        :param index: Sample index; when given, the captcha is drawn from stream
+                      index of the seed tree and is reproducible from (seed, index).
         :return: A PIL Image object representing the final captcha.
         """
 
+        if index is not None:
+            self.set_rngs(*make_rngs(
+                np.random.SeedSequence(self.seed, spawn_key=(index,))
+            ))
+
         # Sample characters and images
-        num_chars = random.randint(*num_char_range)
+        num_chars = self.rng.randint(*num_char_range)
         characters = self.sampler.sample_chars(num_chars=num_chars)
         sampled_images = self.sampler.sample_images_from_characters(characters, k=1)
 
         # Sample colors
         colors = self.sampler.sample_color(num_colors=num_chars)
 
-        # Colorize the images
-        colored_images = [self.colorize_image(img, color) for img, color in zip(sampled_images, colors)]
+        if self.backend == "numpy":
+            # Keep the glyphs as alpha masks, the canvas blends in their colors
+            colored_images = [(self.glyph_alpha(img), color) for img, color in zip(sampled_images, colors)]
+            self.cas(canvas_size=canvas_size, color=background_color, alpha=background_alpha)
+        else:
+            # Colorize the images
+            colored_images = [self.colorize_image(img, color) for img, color in zip(sampled_images, colors)]
 
-        # Create a blank canvas
-        canvas = self.create_canvas(canvas_size=canvas_size, color=background_color, alpha=background_alpha)
-        self.cas(canvas) # Update the canvas
+            # Create a blank canvas
+            canvas = self.create_canvas(canvas_size=canvas_size, color=background_color, alpha=background_alpha)
+            self.cas(canvas) # Update the canvas
 
         # Add characters to the canvas
         self.cas.add_characters_to_canvas(
@@ -451,6 +843,10 @@ class CaptchaSynthesis:
                         width=brush_width
                     )
 
+        # The only conversion of the numpy canvas to PIL
+        if self.backend == "numpy":
+            canvas = self.cas.to_image()
+
         # Ensure the number of characters matches the number of images in the captcha
         characters = characters[:len(colored_images)] 
         
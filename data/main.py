@@ -1,13 +1,19 @@
 import multiprocessing
+import argparse
 import json
 import os
-from captcha_synthesis import CaptchaSynthesis
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from captcha_synthesis import CaptchaSynthesis, BACKENDS
 
-def synthesize_data(worker_id, num_items, input_path, shared_dict):
-    cs = CaptchaSynthesis()
+EXECUTORS = ("process", "thread")
+
+def synthesize_data(worker_id, num_items, input_path, shared_dict, seed=None, backend="pil"):
+    cs = CaptchaSynthesis(backend=backend, seed=seed)
     for _ in range(num_items):
-        # Replace with your actual data synthesis function
-        input_img, label = cs.synthesize_captcha()
+        # Captcha i depends only on (seed, i), not on which worker draws it
+        index = worker_id * num_items + _
+        input_img, label = cs.synthesize_captcha(index=index)
         
         # Save input data to a file and label to the shared dictionary
         input_file = f"input_{worker_id}_{_}.png"  # Or use an appropriate file format
@@ -17,35 +23,73 @@ def synthesize_data(worker_id, num_items, input_path, shared_dict):
         # Store the label with the input file ID in the shared dictionary
         shared_dict[input_file] = ''.join(label)
 
-def main(num_processes, num_items_per_process, input_path, labels_path):
-    manager = multiprocessing.Manager()
-    shared_dict = manager.dict()
+def main(num_workers, num_items_per_worker, input_path, labels_path, seed=None, executor="process", backend="pil"):
+    # Fresh data on every run unless a seed is given; all workers share the root seed
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    print(f"Synthesizing with seed {seed}, pass --seed {seed} to reproduce this run")
+
+    if executor == "thread":
+        # Threads share memory, and PIL/NumPy release the GIL in resizing, drawing and PNG encoding
+        shared_dict = {}
+        with ThreadPoolExecutor(num_workers) as pool:
+            futures = [
+                pool.submit(synthesize_data, i, num_items_per_worker, input_path, shared_dict, seed, backend)
+                for i in range(num_workers)
+            ]
+            for future in futures:
+                future.result()
+    else:
+        manager = multiprocessing.Manager()
+        shared_dict = manager.dict()
 
-    processes = []
-    for i in range(num_processes):
-        p = multiprocessing.Process(
-            target=synthesize_data,
-            args=(i, num_items_per_process, input_path, shared_dict)
-        )
-        processes.append(p)
-        p.start()
+        processes = []
+        for i in range(num_workers):
+            p = multiprocessing.Process(
+                target=synthesize_data,
+                args=(i, num_items_per_worker, input_path, shared_dict, seed, backend)
+            )
+            processes.append(p)
+            p.start()
 
-    for p in processes:
-        p.join()
+        for p in processes:
+            p.join()
 
     # Save the shared dictionary containing labels to path_2
     labels_file_path = os.path.join(labels_path, 'labels.json')
     with open(labels_file_path, 'w') as f:
-        json.dump(dict(shared_dict), f)
+        json.dump(dict(shared_dict), f, sort_keys=True)
+
+    # Record how the set was generated next to its labels
+    with open(os.path.join(labels_path, 'synthesis.json'), 'w') as f:
+        json.dump({
+            "seed": seed,
+            "workers": num_workers,
+            "items_per_worker": num_items_per_worker,
+            "backend": backend,
+        }, f)
 
 if __name__ == '__main__':
-    num_processes = 4  # Number of processes to run in parallel
-    num_items_per_process = 5  # Number of data items each process will generate
-    input_path = 'train_set/imgs/'  # Path where input files will be saved
-    labels_path = 'train_set/'  # Path where label dictionary will be saved
+    parser = argparse.ArgumentParser(description="Synthesize a labeled captcha set.")
+    parser.add_argument("--workers", type=int, default=4, help="number of processes or threads to run in parallel")
+    parser.add_argument("--items-per-worker", type=int, default=5, help="number of data items each worker will generate")
+    parser.add_argument("--input-path", default='train_set/imgs/', help="path where input files will be saved")
+    parser.add_argument("--labels-path", default='train_set/', help="path where label dictionary will be saved")
+    parser.add_argument("--seed", type=int, default=None, help="root seed, fresh entropy by default")
+    parser.add_argument("--executor", default="process", choices=EXECUTORS)
+    parser.add_argument("--backend", default="pil", choices=BACKENDS)
+    args = parser.parse_args()
     
     # Ensure the input and label paths exist
-    os.makedirs(input_path, exist_ok=True)
-    os.makedirs(labels_path, exist_ok=True)
+    os.makedirs(args.input_path, exist_ok=True)
+    os.makedirs(args.labels_path, exist_ok=True)
 
-    main(num_processes, num_items_per_process, input_path, labels_path)
+    main(
+        args.workers,
+        args.items_per_worker,
+        args.input_path,
+        args.labels_path,
+        seed=args.seed,
+        executor=args.executor,
+        backend=args.backend
+    )
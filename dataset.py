@@ -8,42 +8,106 @@ from PIL import ImageFile
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+# channels fed to the model and normalization statistics of every input mode
+INPUT_MODES = {
+    "rgb": {"channels": 3, "mean": (0.485, 0.456, 0.406), "std": (0.229, 0.224, 0.225)},
+    "gray": {"channels": 1, "mean": (0.449,), "std": (0.226,)},
+    # darkest RGB channel of each pixel, keeps light colored glyphs visible on white
+    "min": {"channels": 1, "mean": (0.449,), "std": (0.226,)},
+}
+
+
+def load_image(image, input_mode="rgb", resize=None):
+    # image can be a path, a file object or a PIL image; resize = (height, width)
+    # returns a (height, width, channels) uint8 array
+    if input_mode not in INPUT_MODES:
+        raise ValueError(f"Unknown input mode: {input_mode}")
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    image = image.convert("L" if input_mode == "gray" else "RGB")
+
+    if resize is not None:
+        image = image.resize((resize[1], resize[0]), resample=Image.BILINEAR)
+
+    image = np.array(image)
+    if input_mode == "min":
+        image = image.min(axis=2)
+    if image.ndim == 2:
+        image = image[..., None]
+    return image
+
+
+def build_normalizer(input_mode="rgb"):
+    mode = INPUT_MODES[input_mode]
+    return albumentations.Compose(
+        [
+            albumentations.Normalize(
+                mode["mean"], mode["std"], max_pixel_value=255.0, always_apply=True
+            )
+        ]
+    )
+
+
+def to_tensor(image, aug):
+    augmented = aug(image=image)
+    image = augmented["image"]
+    image = np.transpose(image, (2, 0, 1)).astype(np.float32)
+    return torch.tensor(image, dtype=torch.float)
+
 
 class ClassificationDataset:
-    def __init__(self, image_paths, targets, resize=None):
+    def __init__(
+        self,
+        image_paths,
+        targets,
+        resize=None,
+        target_lengths=None,
+        return_index=False,
+        input_mode="rgb",
+        preload=False,
+    ):
         # resize = (height, width)
+        # target_lengths is required when targets are zero-padded to a common length
+        # return_index adds the sample position, used to look up cached teacher logits
+        # preload decodes every image once into a single uint8 array (needs resize)
         self.image_paths = image_paths
         self.targets = targets
         self.resize = resize
+        self.target_lengths = target_lengths
+        self.return_index = return_index
+        self.input_mode = input_mode
+        self.aug = build_normalizer(input_mode)
 
-        mean = (0.485, 0.456, 0.406)
-        std = (0.229, 0.224, 0.225)
-        self.aug = albumentations.Compose(
-            [
-                albumentations.Normalize(
-                    mean, std, max_pixel_value=255.0, always_apply=True
-                )
-            ]
-        )
+        self.cache = None
+        if preload:
+            if resize is None:
+                raise ValueError("preload requires a fixed resize")
+            self.cache = np.stack(
+                [load_image(self._open(i), input_mode, resize) for i in range(len(self))]
+            )
 
     def __len__(self):
         return len(self.image_paths)
 
+    def _open(self, item):
+        # anything load_image accepts; subclasses may read from other storage
+        return self.image_paths[item]
+
     def __getitem__(self, item):
-        image = Image.open(self.image_paths[item]).convert("RGB")
+        if self.cache is not None:
+            image = self.cache[item]
+        else:
+            image = load_image(self._open(item), self.input_mode, self.resize)
         targets = self.targets[item]
 
-        if self.resize is not None:
-            image = image.resize(
-                (self.resize[1], self.resize[0]), resample=Image.BILINEAR
-            )
-
-        image = np.array(image)
-        augmented = self.aug(image=image)
-        image = augmented["image"]
-        image = np.transpose(image, (2, 0, 1)).astype(np.float32)
-
-        return {
-            "images": torch.tensor(image, dtype=torch.float),
+        sample = {
+            "images": to_tensor(image, self.aug),
             "targets": torch.tensor(targets, dtype=torch.long),
-        }
\ No newline at end of file
+        }
+        if self.target_lengths is not None:
+            sample["target_lengths"] = torch.tensor(
+                self.target_lengths[item], dtype=torch.long
+            )
+        if self.return_index:
+            sample["indices"] = torch.tensor(item, dtype=torch.long)
+        return sample
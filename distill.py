@@ -0,0 +1,194 @@
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+import config
+import engine
+import train
+from model import CaptchaModel, VARIANTS, load_checkpoint, save_checkpoint
+from profile_models import count_params, cpu_latency, validation_accuracy
+
+
+def _weights_digest(model):
+    digest = hashlib.md5()
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _cache_digest(teacher, records, input_mode):
+    # everything the cached logits depend on: the samples, the teacher and how it sees them
+    key = {
+        "records": [r["path"] for r in records],
+        "teacher": _weights_digest(teacher),
+        "input_mode": input_mode,
+        "input_size": list(teacher.config["input_size"]),
+        "shape": [len(records), teacher.sequence_length, teacher.config["num_chars"] + 1],
+    }
+    return hashlib.md5(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def cache_teacher_logits(teacher, records, cache_path, input_mode="rgb", batch_size=64):
+    """
+    Runs the frozen teacher once over the records and stores its frame-level
+    logits as a (num_samples, time_steps, num_classes) float16 .npy file.
+    The cache is reused only while the records, the teacher weights, its
+    input mode and size and the logits shape are all unchanged.
+    :return: A read-only memory map of the cached logits.
+    """
+    meta_path = cache_path + ".json"
+    digest = _cache_digest(teacher, records, input_mode)
+    if os.path.exists(cache_path) and os.path.exists(meta_path):
+        if json.load(open(meta_path, "r")).get("cache_digest") == digest:
+            return np.load(cache_path, mmap_mode="r")
+        print(f"{cache_path} was built for other records or another teacher, rebuilding it.")
+
+    loader = train.build_loader(
+        records,
+        shuffle=False,
+        batch_size=batch_size,
+        return_index=True,
+        input_mode=input_mode,
+        input_size=teacher.config["input_size"],
+    )
+    teacher.to(config.DEVICE)
+    teacher.eval()
+    logits_cache = None
+    with torch.no_grad():
+        for data in tqdm(loader, total=len(loader)):
+            indices = data.pop("indices").numpy()
+            logits, _ = teacher(data["images"].to(config.DEVICE))
+            logits = logits.permute(1, 0, 2).cpu().numpy()
+            if logits_cache is None:
+                logits_cache = np.lib.format.open_memmap(
+                    cache_path,
+                    mode="w+",
+                    dtype=np.float16,
+                    shape=(len(records), logits.shape[1], logits.shape[2]),
+                )
+            logits_cache[indices] = logits
+    logits_cache.flush()
+    del logits_cache
+
+    with open(meta_path, "w") as f:
+        json.dump({"cache_digest": digest}, f)
+    return np.load(cache_path, mmap_mode="r")
+
+
+def run_distillation(
+    teacher_path=config.MODEL_PATH,
+    student_variant="tiny",
+    student_path="student.pt",
+    cache_path="teacher_logits.npy",
+    epochs=config.EPOCHS,
+    alpha=0.5,
+    temperature=2.0,
+):
+    lbl_enc, train_records, test_records = train.load_manifest_splits()
+    test_targets_orig = [r["label"] for r in test_records]
+    teacher, checkpoint = load_checkpoint(teacher_path)
+    if checkpoint["classes"] != list(lbl_enc.classes_):
+        raise ValueError("Teacher checkpoint classes do not match the manifest classes.")
+    for p in teacher.parameters():
+        p.requires_grad = False
+
+    input_mode = checkpoint["input_mode"]
+    input_size = teacher.config["input_size"]
+    teacher_logits = cache_teacher_logits(teacher, train_records, cache_path, input_mode)
+
+    student = CaptchaModel(
+        num_chars=len(lbl_enc.classes_),
+        input_channels=teacher.config["input_channels"],
+        input_size=input_size,
+        time_steps=teacher.config["time_steps"],
+        **VARIANTS[student_variant],
+    )
+    if student.sequence_length != teacher_logits.shape[1]:
+        raise ValueError(
+            f"Student emits {student.sequence_length} frames but the teacher emits "
+            f"{teacher_logits.shape[1]}; use the same input size and time_steps."
+        )
+    if teacher_logits.shape[2] != len(lbl_enc.classes_) + 1:
+        raise ValueError(
+            f"Teacher logits have {teacher_logits.shape[2]} classes, expected "
+            f"{len(lbl_enc.classes_) + 1} (the manifest classes plus the blank)."
+        )
+    student.to(config.DEVICE)
+
+    train_loader = train.build_loader(
+        train_records,
+        shuffle=True,
+        return_index=True,
+        input_mode=input_mode,
+        input_size=input_size,
+    )
+    test_loader = train.build_loader(
+        test_records, shuffle=False, input_mode=input_mode, input_size=input_size
+    )
+    optimizer = torch.optim.Adam(student.parameters(), lr=3e-4)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, factor=0.8, patience=5)
+    best_accuracy = -1.0
+    for epoch in range(epochs):
+        train_loss = engine.distill_fn(
+            student, train_loader, optimizer, teacher_logits, alpha, temperature
+        )
+        valid_preds, test_loss = engine.eval_fn(student, test_loader)
+        accuracy, _ = train.captcha_accuracy(valid_preds, test_targets_orig, lbl_enc)
+        print(
+            f"Epoch={epoch}, Distill Loss={train_loss}, Test Loss={test_loss} Accuracy={accuracy}"
+        )
+        scheduler.step(test_loss)
+        if accuracy > best_accuracy:
+            best_accuracy = accuracy
+            save_checkpoint(
+                student_path,
+                student,
+                lbl_enc.classes_,
+                accuracy=float(accuracy),
+                input_mode=input_mode,
+                teacher=teacher_path,
+            )
+
+    student, _ = load_checkpoint(student_path)
+    report = {}
+    for name, model in (("teacher", teacher), ("student", student)):
+        input_channels = model.config["input_channels"]
+        input_size = model.config["input_size"]
+        latency_ms = cpu_latency(model, input_channels, input_size, batch_size=32)
+        report[name] = {
+            "params": count_params(model),
+            "accuracy": validation_accuracy(model, test_records, lbl_enc, input_mode),
+            "images_per_sec": 32 / latency_ms * 1000,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill a small student from a CaptchaModel teacher.")
+    parser.add_argument("--teacher", default=config.MODEL_PATH)
+    parser.add_argument("--student", default="tiny", choices=list(VARIANTS))
+    parser.add_argument("--output", default="student.pt")
+    parser.add_argument("--cache", default="teacher_logits.npy")
+    parser.add_argument("--epochs", type=int, default=config.EPOCHS)
+    parser.add_argument("--alpha", type=float, default=0.5)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    args = parser.parse_args()
+
+    report = run_distillation(
+        teacher_path=args.teacher,
+        student_variant=args.student,
+        student_path=args.output,
+        cache_path=args.cache,
+        epochs=args.epochs,
+        alpha=args.alpha,
+        temperature=args.temperature,
+    )
+    print(f"{'model':<10}{'params':>10}{'accuracy':>10}{'img/s (cpu)':>14}")
+    for name, r in report.items():
+        print(f"{name:<10}{r['params']:>10}{r['accuracy']:>10.4f}{r['images_per_sec']:>14.1f}")
@@ -1,20 +1,61 @@
+import time
 from tqdm import tqdm
 import torch
+from torch.nn import functional as F
 import config
 
 
-def train_fn(model, data_loader, optimizer):
+def train_fn(model, data_loader, optimizer, stats=None):
+    # stats, if given, receives the epoch's total time and the time spent waiting on data
     model.train()
     fin_loss = 0
+    data_time = 0.0
+    epoch_start = time.perf_counter()
     tk0 = tqdm(data_loader, total=len(data_loader))
+    wait_start = time.perf_counter()
     for data in tk0:
+        data_time += time.perf_counter() - wait_start
         for key, value in data.items():
-            data[key] = value.to(config.DEVICE)
+            data[key] = value.to(config.DEVICE, non_blocking=True)
         optimizer.zero_grad()
         _, loss = model(**data)
         loss.backward()
         optimizer.step()
         fin_loss += loss.item()
+        wait_start = time.perf_counter()
+    if stats is not None:
+        stats["data_time"] = data_time
+        stats["total_time"] = time.perf_counter() - epoch_start
+    return fin_loss / len(data_loader)
+
+
+def distill_fn(student, data_loader, optimizer, teacher_logits, alpha=0.5, temperature=2.0):
+    # teacher_logits: (num_samples, time_steps, num_classes) array, e.g. a np.memmap,
+    # indexed by the "indices" the dataset returns
+    student.train()
+    fin_loss = 0
+    tk0 = tqdm(data_loader, total=len(data_loader))
+    for data in tk0:
+        indices = data.pop("indices").numpy()
+        soft_targets = torch.tensor(
+            teacher_logits[indices], dtype=torch.float, device=config.DEVICE
+        )
+        soft_targets = torch.softmax(soft_targets / temperature, 2)
+        for key, value in data.items():
+            data[key] = value.to(config.DEVICE)
+        optimizer.zero_grad()
+        logits, ctc_loss = student(**data)
+        # frame-level KL divergence between temperature-softened distributions
+        student_log_probs = F.log_softmax(logits.permute(1, 0, 2) / temperature, 2)
+        kd_loss = F.kl_div(
+            student_log_probs.reshape(-1, student_log_probs.size(2)),
+            soft_targets.reshape(-1, soft_targets.size(2)),
+            reduction="batchmean",
+        ) * (temperature ** 2)
+        loss = alpha * kd_loss + (1 - alpha) * ctc_loss
+        loss.backward()
+        optimizer.step()
+        fin_loss += loss.item()
     return fin_loss / len(data_loader)
 
 
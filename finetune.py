@@ -0,0 +1,226 @@
+import time
+import random
+import argparse
+
+import numpy as np
+import torch
+from sklearn import preprocessing
+
+import config
+import engine
+import manifest
+import train
+from model import CaptchaModel, load_checkpoint, save_checkpoint
+
+
+class ReplayBuffer:
+    def __init__(self, capacity, seed=42):
+        """
+        Fixed-size uniform sample of a stream (reservoir sampling), used to
+        keep synthetic samples in the fine-tuning mix without loading them all.
+        """
+        self.capacity = capacity
+        self.items = []
+        self.seen = 0
+        self._random = random.Random(seed)
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.capacity:
+            self.items.append(item)
+        else:
+            j = self._random.randrange(self.seen)
+            if j < self.capacity:
+                self.items[j] = item
+
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+
+
+def reencode(records, classes):
+    """
+    Encodes labels with a checkpoint's classes; records with characters the
+    model cannot emit are dropped.
+    """
+    encoded = []
+    for r in records:
+        try:
+            encoded.append({**r, "encoded": manifest.encode_label(r["label"], classes)})
+        except ValueError:
+            continue
+    return encoded
+
+
+def time_to_accuracy(history, target):
+    # first elapsed time at which a (seconds, accuracy) history reaches target
+    for elapsed, accuracy in history:
+        if accuracy >= target:
+            return elapsed
+    return None
+
+
+def train_until_plateau(
+    model,
+    train_loader,
+    test_loader,
+    test_targets_orig,
+    lbl_enc,
+    epochs,
+    patience,
+    lr,
+    on_improvement=None,
+    name="",
+):
+    """
+    Trains until accuracy on the test loader has not improved for patience
+    epochs, calling on_improvement(accuracy, history) at every new best.
+    :return: (best accuracy, [(elapsed seconds, accuracy)] per epoch)
+    """
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    best_accuracy = -1.0
+    epochs_without_improvement = 0
+    history = []
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        train_loss = engine.train_fn(model, train_loader, optimizer)
+        valid_preds, test_loss = engine.eval_fn(model, test_loader)
+        accuracy, _ = train.captcha_accuracy(valid_preds, test_targets_orig, lbl_enc)
+        history.append((time.perf_counter() - start, float(accuracy)))
+        print(
+            f"{name}Epoch={epoch}, Train Loss={train_loss}, Real Test Loss={test_loss} "
+            f"Real Accuracy={accuracy}"
+        )
+        if accuracy > best_accuracy:
+            best_accuracy = accuracy
+            epochs_without_improvement = 0
+            if on_improvement is not None:
+                on_improvement(accuracy, history)
+        else:
+            epochs_without_improvement += 1
+            if epochs_without_improvement >= patience:
+                print(f"No improvement for {patience} epochs, stopping.")
+                break
+    return best_accuracy, history
+
+
+def run_finetuning(
+    checkpoint_path=config.MODEL_PATH,
+    real_manifest_path="data/real_set/manifest.jsonl",
+    output_path="finetuned.pt",
+    replay_size=2000,
+    epochs=20,
+    patience=3,
+    lr=1e-4,
+    target_accuracy=0.9,
+    scratch_epochs=0,
+):
+    """
+    Warm-starts from a checkpoint and trains on the train split of newly
+    labeled real images mixed with a reservoir sample of the synthetic
+    training set, stopping once accuracy on the real test split stops improving.
+    With scratch_epochs > 0 the same architecture is also trained from scratch
+    on the whole synthetic training set plus the real train split, scored on
+    the same real test split, so both times to target_accuracy are comparable.
+    """
+    model, checkpoint = load_checkpoint(checkpoint_path)
+    classes = checkpoint["classes"]
+    input_mode = checkpoint["input_mode"]
+    input_size = model.config["input_size"]
+    model.to(config.DEVICE)
+
+    real_header, real_records = manifest.load_manifest(real_manifest_path)
+    real_records = reencode(real_records, classes)
+    real_train, real_test = manifest.train_test_records(
+        real_records, real_manifest_path, real_header["test_size"]
+    )
+
+    _, synthetic_train, _ = train.load_manifest_splits()
+    synthetic_train = reencode(synthetic_train, classes)
+    replay = ReplayBuffer(replay_size)
+    replay.extend(synthetic_train)
+
+    train_loader, test_loader = train.build_loaders(
+        real_train + replay.items,
+        real_test,
+        input_mode=input_mode,
+        input_size=input_size,
+    )
+    test_targets_orig = [r["label"] for r in real_test]
+    lbl_enc = preprocessing.LabelEncoder()
+    lbl_enc.classes_ = np.array(classes)
+
+    def save(accuracy, history):
+        save_checkpoint(
+            output_path,
+            model,
+            classes,
+            accuracy=float(accuracy),
+            input_mode=input_mode,
+            history=history,
+            base_checkpoint=checkpoint_path,
+        )
+
+    best_accuracy, history = train_until_plateau(
+        model, train_loader, test_loader, test_targets_orig, lbl_enc,
+        epochs, patience, lr, on_improvement=save,
+    )
+
+    # the base checkpoint's own history was scored on the synthetic split, not comparable
+    full_training_seconds = None
+    if scratch_epochs > 0:
+        scratch_loader = train.build_loader(
+            synthetic_train + real_train, shuffle=True, input_mode=input_mode, input_size=input_size
+        )
+        scratch_model = CaptchaModel(**model.config).to(config.DEVICE)
+        _, scratch_history = train_until_plateau(
+            scratch_model, scratch_loader, test_loader, test_targets_orig, lbl_enc,
+            scratch_epochs, patience, 3e-4, name="From scratch: ",
+        )
+        full_training_seconds = time_to_accuracy(scratch_history, target_accuracy)
+
+    return {
+        "best_accuracy": best_accuracy,
+        "finetune_seconds": time_to_accuracy(history, target_accuracy),
+        "full_training_seconds": full_training_seconds,
+        "full_training_measured": scratch_epochs > 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fine-tune a checkpoint on newly labeled real captchas.")
+    parser.add_argument("--checkpoint", default=config.MODEL_PATH)
+    parser.add_argument("--real-manifest", required=True,
+                        help="manifest of the real images, see manifest.py build")
+    parser.add_argument("--output", default="finetuned.pt")
+    parser.add_argument("--replay-size", type=int, default=2000)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--patience", type=int, default=3)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--target-accuracy", type=float, default=0.9)
+    parser.add_argument("--scratch-epochs", type=int, default=0,
+                        help="also time a from-scratch run on the same real test split, 0 skips it")
+    args = parser.parse_args()
+
+    report = run_finetuning(
+        checkpoint_path=args.checkpoint,
+        real_manifest_path=args.real_manifest,
+        output_path=args.output,
+        replay_size=args.replay_size,
+        epochs=args.epochs,
+        patience=args.patience,
+        lr=args.lr,
+        target_accuracy=args.target_accuracy,
+        scratch_epochs=args.scratch_epochs,
+    )
+
+    def describe(seconds):
+        return "not reached" if seconds is None else f"{seconds:.1f}s"
+
+    print(f"Best real accuracy: {report['best_accuracy']:.4f}")
+    print(f"Time to accuracy {args.target_accuracy}:")
+    print(f"  fine-tuning:   {describe(report['finetune_seconds'])}")
+    if report["full_training_measured"]:
+        print(f"  full training: {describe(report['full_training_seconds'])}")
+    else:
+        print("  full training: unavailable, pass --scratch-epochs to measure it on the same split")
@@ -0,0 +1,213 @@
+import io
+import hashlib
+import argparse
+from collections import defaultdict
+
+import torch
+from torch import nn
+
+import config
+import dataset
+from cache import ResultCache
+from model import load_checkpoint
+from train import remove_duplicates
+
+
+def greedy_decode(logits, classes):
+    """
+    Greedy CTC decoding of a (time_steps, batch, num_classes + 1) model output.
+    :return: A list of (text, confidence) where confidence is the probability
+             of the greedy frame path.
+    """
+    probs = torch.softmax(logits.permute(1, 0, 2), 2)
+    max_probs, best = probs.max(2)
+    confidences = torch.exp(torch.log(max_probs).sum(1))
+    results = []
+    for j in range(best.size(0)):
+        # 0 is the CTC blank, class k is encoded as k + 1
+        text = "".join(classes[k - 1] for k in best[j].tolist() if k != 0)
+        results.append((remove_duplicates(text), float(confidences[j])))
+    return results
+
+
+def _prefix_beam_search(probs, beam_width, min_prob=1e-3):
+    # probs: (time_steps, num_classes + 1) frame probabilities of one sequence
+    # every beam keeps the probability of ending in a blank and in a non-blank
+    beams = {(): (1.0, 0.0)}
+    for frame in probs:
+        candidates = [c for c in range(1, len(frame)) if frame[c] >= min_prob]
+        next_beams = defaultdict(lambda: [0.0, 0.0])
+        for prefix, (p_blank, p_char) in beams.items():
+            next_beams[prefix][0] += (p_blank + p_char) * frame[0]
+            for c in candidates:
+                if prefix and prefix[-1] == c:
+                    # a repeat only extends the prefix across a blank
+                    next_beams[prefix][1] += p_char * frame[c]
+                    next_beams[prefix + (c,)][1] += p_blank * frame[c]
+                else:
+                    next_beams[prefix + (c,)][1] += (p_blank + p_char) * frame[c]
+        ranked = sorted(next_beams.items(), key=lambda kv: -sum(kv[1]))
+        beams = dict(ranked[:beam_width])
+    prefix, (p_blank, p_char) = max(beams.items(), key=lambda kv: sum(kv[1]))
+    return prefix, p_blank + p_char
+
+
+def beam_decode(logits, classes, beam_width=8):
+    """
+    CTC prefix beam search over a (time_steps, batch, num_classes + 1) output.
+    :return: A list of (text, confidence) where confidence is the summed
+             probability of all frame paths of the best prefix.
+    """
+    probs = torch.softmax(logits.permute(1, 0, 2), 2).double().cpu().numpy()
+    results = []
+    for sequence in probs:
+        prefix, confidence = _prefix_beam_search(sequence, beam_width)
+        text = "".join(classes[k - 1] for k in prefix)
+        results.append((remove_duplicates(text), float(confidence)))
+    return results
+
+
+def _image_bytes(image):
+    # encoded bytes of an image given as bytes or a path, None for anything else
+    if isinstance(image, bytes):
+        return image
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return f.read()
+    return None
+
+
+class CaptchaSolver:
+    def __init__(self, model_path=config.MODEL_PATH, device="cpu", cache=None, quantize=False):
+        """
+        Loads a checkpoint written by train.run_training and preprocesses
+        images with the input mode and resolution it was trained on.
+        An optional cache.ResultCache short-circuits images it has seen before;
+        it is bound to this checkpoint, so results of another model are dropped.
+        quantize applies dynamic int8 quantization to the linear and GRU layers (CPU only).
+        """
+        self.model, checkpoint = load_checkpoint(model_path, map_location=device)
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(
+                self.model, {nn.Linear, nn.GRU}, dtype=torch.qint8
+            )
+        self.model.to(device)
+        self.model.eval()
+        self.device = device
+        self.classes = checkpoint["classes"]
+        self.input_mode = checkpoint["input_mode"]
+        self.input_size = self.model.config["input_size"]
+        self.aug = dataset.build_normalizer(self.input_mode)
+        self.cache = cache
+        if cache is not None:
+            with open(model_path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            # quantized weights give slightly different answers than the float ones
+            cache.bind(f"{digest}:{'int8' if quantize else 'float'}")
+
+    def preprocess(self, image):
+        # image can be raw encoded bytes, a path, a file object or a PIL image
+        if isinstance(image, bytes):
+            image = io.BytesIO(image)
+        image = dataset.load_image(image, self.input_mode, self.input_size)
+        return dataset.to_tensor(image, self.aug)
+
+    def logits(self, images):
+        batch = torch.stack([self.preprocess(image) for image in images])
+        with torch.no_grad():
+            logits, _ = self.model(batch.to(self.device))
+        return logits
+
+    def solve_batch(self, images):
+        if self.cache is None:
+            return greedy_decode(self.logits(images), self.classes)
+
+        results = [None] * len(images)
+        misses = []
+        for i, image in enumerate(images):
+            image_bytes = _image_bytes(image)
+            if image_bytes is not None:
+                results[i] = self.cache.get(image_bytes)
+                # keep the bytes so a path is not read twice
+                image = image_bytes
+            if results[i] is None:
+                misses.append((i, image, image_bytes))
+
+        if misses:
+            decoded = greedy_decode(self.logits([m[1] for m in misses]), self.classes)
+            for (i, _, image_bytes), result in zip(misses, decoded):
+                results[i] = result
+                if image_bytes is not None:
+                    self.cache.put(image_bytes, *result)
+        return results
+
+    def solve(self, image):
+        return self.solve_batch([image])[0]
+
+
+class CascadeSolver:
+    def __init__(self, fast, full, threshold=0.9, beam_width=0):
+        """
+        Solves with the fast solver first and re-batches only the results whose
+        greedy path confidence is below threshold through the full solver,
+        with beam search when beam_width > 1.
+        """
+        if list(fast.classes) != list(full.classes):
+            raise ValueError(
+                f"The fast and full models use different classes ({''.join(fast.classes)} vs "
+                f"{''.join(full.classes)}); their results cannot be mixed."
+            )
+        self.fast = fast
+        self.full = full
+        self.threshold = threshold
+        self.beam_width = beam_width
+        self.total = 0
+        self.escalated = 0
+
+    @property
+    def escalation_rate(self):
+        return self.escalated / self.total if self.total else 0.0
+
+    def solve_batch(self, images):
+        results = self.fast.solve_batch(images)
+        unsure = [i for i, (_, confidence) in enumerate(results) if confidence < self.threshold]
+        if unsure:
+            logits = self.full.logits([images[i] for i in unsure])
+            if self.beam_width > 1:
+                decoded = beam_decode(logits, self.full.classes, self.beam_width)
+            else:
+                decoded = greedy_decode(logits, self.full.classes)
+            for i, result in zip(unsure, decoded):
+                results[i] = result
+        self.total += len(images)
+        self.escalated += len(unsure)
+        return results
+
+    def solve(self, image):
+        return self.solve_batch([image])[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve captcha images.")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--model", default=config.MODEL_PATH)
+    parser.add_argument("--cache-size", type=int, default=0, help="0 disables the result cache")
+    parser.add_argument("--cache-ttl", type=float, default=None)
+    parser.add_argument("--cache-path", default=None)
+    parser.add_argument("--perceptual", action="store_true")
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache_size > 0:
+        cache = ResultCache(
+            max_size=args.cache_size,
+            ttl=args.cache_ttl,
+            persist_path=args.cache_path,
+            perceptual=args.perceptual,
+        )
+    solver = CaptchaSolver(args.model, cache=cache)
+    for path, (text, confidence) in zip(args.images, solver.solve_batch(args.images)):
+        print(f"{path}\t{text}\t{confidence:.4f}")
+    if cache is not None:
+        print(cache.stats())
+        cache.close()
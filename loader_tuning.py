@@ -0,0 +1,141 @@
+import os
+import copy
+import json
+import time
+import argparse
+
+import torch
+
+import config
+
+
+def loader_options():
+    # DataLoader settings persisted by autotune_loader, else the config defaults
+    options = {
+        "batch_size": config.BATCH_SIZE,
+        "num_workers": config.NUM_WORKERS,
+        "prefetch_factor": 2,
+    }
+    if os.path.exists(config.LOADER_CONFIG_PATH):
+        options.update(json.load(open(config.LOADER_CONFIG_PATH, "r")))
+    return options
+
+
+def make_data_loader(data, shuffle, batch_size, num_workers, prefetch_factor=2):
+    # workers stay alive across epochs instead of being re-forked by every iterator
+    kwargs = {}
+    if num_workers > 0:
+        kwargs = {"persistent_workers": True, "prefetch_factor": prefetch_factor}
+    return torch.utils.data.DataLoader(
+        data,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        shuffle=shuffle,
+        pin_memory=config.DEVICE.startswith("cuda"),
+        **kwargs,
+    )
+
+
+def measure_loader(loader, model, optimizer, steps=20, warmup=3):
+    """
+    Runs training steps and splits their wall time into waiting on the
+    loader and computing.
+    :return: (fraction of time spent waiting on data, samples per second)
+    """
+    model.train()
+    data_time = 0.0
+    samples = 0
+    iterator = iter(loader)
+    for step in range(warmup + steps):
+        if step == warmup:
+            measure_start = time.perf_counter()
+            data_time = 0.0
+            samples = 0
+        start = time.perf_counter()
+        try:
+            data = next(iterator)
+        except StopIteration:
+            iterator = iter(loader)
+            data = next(iterator)
+        data_time += time.perf_counter() - start
+        for key, value in data.items():
+            data[key] = value.to(config.DEVICE, non_blocking=True)
+        optimizer.zero_grad()
+        _, loss = model(**data)
+        loss.backward()
+        optimizer.step()
+        # .item() waits for the device, so compute time is fully accounted for
+        loss.item()
+        samples += data["images"].size(0)
+    elapsed = time.perf_counter() - measure_start
+    return data_time / elapsed, samples / elapsed
+
+
+def autotune_loader(
+    data,
+    model,
+    worker_counts=(0, 2, 4, 8),
+    prefetch_factors=(2, 4),
+    batch_sizes=(8, 16, 32),
+    steps=20,
+    output_path=config.LOADER_CONFIG_PATH,
+):
+    """
+    Sweeps DataLoader settings on a copy of the model, keeps the one with
+    the highest training throughput and persists it to output_path.
+    """
+    model = copy.deepcopy(model).to(config.DEVICE)
+    optimizer = torch.optim.Adam(model.parameters(), lr=3e-4)
+    worker_counts = [w for w in worker_counts if w <= (os.cpu_count() or 1)]
+
+    results = []
+    for batch_size in batch_sizes:
+        for num_workers in worker_counts:
+            # prefetching only applies to worker processes
+            for prefetch_factor in prefetch_factors if num_workers > 0 else prefetch_factors[:1]:
+                loader = make_data_loader(data, True, batch_size, num_workers, prefetch_factor)
+                stall, throughput = measure_loader(loader, model, optimizer, steps)
+                del loader
+                options = {
+                    "batch_size": batch_size,
+                    "num_workers": num_workers,
+                    "prefetch_factor": prefetch_factor,
+                }
+                print(f"{options} Data Stall={stall:.1%} Samples/s={throughput:.1f}")
+                results.append((throughput, stall, options))
+
+    throughput, stall, best = max(results, key=lambda r: r[0])
+    print(f"Selected {best} Data Stall={stall:.1%} Samples/s={throughput:.1f}")
+    with open(output_path, "w") as f:
+        json.dump(best, f)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Autotune the training DataLoader.")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--workers", nargs="+", type=int, default=[0, 2, 4, 8])
+    parser.add_argument("--prefetch", nargs="+", type=int, default=[2, 4])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[8, 16, 32])
+    args = parser.parse_args()
+
+    # imported here, train itself builds its loaders with this module
+    import train
+    from model import CaptchaModel, VARIANTS
+    from dataset import INPUT_MODES
+
+    lbl_enc, train_records, _ = train.load_manifest_splits()
+    model = CaptchaModel(
+        num_chars=len(lbl_enc.classes_),
+        input_channels=INPUT_MODES[config.INPUT_MODE]["channels"],
+        input_size=(config.IMAGE_HEIGHT, config.IMAGE_WIDTH),
+        **VARIANTS[config.MODEL_VARIANT],
+    )
+    autotune_loader(
+        train.build_dataset(train_records),
+        model,
+        worker_counts=args.workers,
+        prefetch_factors=args.prefetch,
+        batch_sizes=args.batch_sizes,
+        steps=args.steps,
+    )
@@ -0,0 +1,147 @@
+import os
+import glob
+import json
+import hashlib
+import argparse
+
+from PIL import Image
+
+import config
+
+MANIFEST_VERSION = 1
+
+
+def assign_split(file_name, test_size=config.TEST_SIZE):
+    """
+    Deterministically assigns a sample to the train or test split from a
+    hash of its file name, so appending new shards never reshuffles the
+    existing assignment.
+    """
+    digest = hashlib.md5(file_name.encode("utf-8")).hexdigest()
+    return "test" if int(digest[:8], 16) / 0xFFFFFFFF < test_size else "train"
+
+
+def encode_label(label, classes):
+    # 0 is reserved for the CTC blank, hence the + 1
+    unknown = sorted(set(label) - set(classes))
+    if unknown:
+        raise ValueError(
+            f"Label {label!r} contains characters {unknown} outside the manifest "
+            f"classes; rebuild the manifest instead of appending."
+        )
+    return [classes.index(c) + 1 for c in label]
+
+
+def make_record(image_path, label, classes, test_size=config.TEST_SIZE):
+    with Image.open(image_path) as image:
+        width, height = image.size
+    return {
+        "path": image_path,
+        "label": label,
+        "encoded": encode_label(label, classes),
+        "length": len(label),
+        "size": [width, height],
+        "split": assign_split(os.path.basename(image_path), test_size),
+    }
+
+
+def _list_labeled_images(image_dir, labels_path):
+    labels_dict = json.load(open(labels_path, "r"))
+    image_files = sorted(glob.glob(os.path.join(image_dir, "*.png")))
+    return [(x, labels_dict[os.path.basename(x)]) for x in image_files]
+
+
+def build_manifest(image_dir, labels_path, manifest_path, test_size=config.TEST_SIZE):
+    """
+    Indexes every labeled png in image_dir into a JSON-lines manifest. The
+    first line is a header holding the character classes, every following
+    line describes one sample.
+    """
+    labeled = _list_labeled_images(image_dir, labels_path)
+    classes = sorted({c for _, label in labeled for c in label})
+    header = {"version": MANIFEST_VERSION, "classes": classes, "test_size": test_size}
+
+    with open(manifest_path, "w") as f:
+        f.write(json.dumps(header) + "\n")
+        for image_path, label in labeled:
+            record = make_record(image_path, label, classes, test_size)
+            f.write(json.dumps(record) + "\n")
+
+    return header
+
+
+def read_header(manifest_path):
+    with open(manifest_path, "r") as f:
+        return json.loads(f.readline())
+
+
+def load_manifest(manifest_path):
+    """
+    Reads the manifest in a single pass.
+    :return: (header, records)
+    """
+    with open(manifest_path, "r") as f:
+        header = json.loads(f.readline())
+        records = [json.loads(line) for line in f if line.strip()]
+    if header.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version: {header.get('version')}")
+    return header, records
+
+
+def append_to_manifest(manifest_path, image_dir, labels_path):
+    """
+    Appends a newly generated shard to an existing manifest. Images that are
+    already indexed are skipped; the split of existing samples is unchanged.
+    :return: The number of appended records.
+    """
+    header, records = load_manifest(manifest_path)
+    indexed = {r["path"] for r in records}
+
+    appended = 0
+    with open(manifest_path, "a") as f:
+        for image_path, label in _list_labeled_images(image_dir, labels_path):
+            if image_path in indexed:
+                continue
+            record = make_record(image_path, label, header["classes"], header["test_size"])
+            f.write(json.dumps(record) + "\n")
+            appended += 1
+
+    return appended
+
+
+def split_records(records, split):
+    return [r for r in records if r["split"] == split]
+
+
+def train_test_records(records, manifest_path, test_size):
+    """
+    :return: (train records, test records)
+    :raises ValueError: If either split is empty, which the file name hash
+                        makes likely on small manifests.
+    """
+    train_records = split_records(records, "train")
+    test_records = split_records(records, "test")
+    for split, selected in (("train", train_records), ("test", test_records)):
+        if not selected:
+            raise ValueError(
+                f"The {split} split of {manifest_path} is empty ({len(records)} images, "
+                f"test_size={test_size}); add images or rebuild it with another test_size."
+            )
+    return train_records, test_records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or extend a dataset manifest.")
+    parser.add_argument("command", choices=["build", "append"])
+    parser.add_argument("--image-dir", default=config.DATA_DIR)
+    parser.add_argument("--labels", default=config.LABELS_DIR)
+    parser.add_argument("--manifest", default=config.MANIFEST_PATH)
+    parser.add_argument("--test-size", type=float, default=config.TEST_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        header = build_manifest(args.image_dir, args.labels, args.manifest, args.test_size)
+        print(f"Wrote {args.manifest} with classes {''.join(header['classes'])}")
+    else:
+        appended = append_to_manifest(args.manifest, args.image_dir, args.labels)
+        print(f"Appended {appended} records to {args.manifest}")
@@ -3,30 +3,130 @@ from torch import nn
 from torch.nn import functional as F
 
 
+# Named architecture variants, from the original model down to the cheapest one.
+# Every key is a CaptchaModel keyword argument.
+VARIANTS = {
+    "base": {},
+    "slim": {"conv_channels": (64, 32)},
+    "separable": {"conv_channels": (64, 64), "separable": True},
+    "separable_conv_head": {"conv_channels": (64, 64), "separable": True, "head": "conv"},
+    "tiny": {
+        "conv_channels": (32, 32),
+        "separable": True,
+        "head": "conv",
+        "linear_size": 32,
+        "hidden_size": 16,
+    },
+}
+
+
+def conv_block(in_channels, out_channels, separable=False):
+    if separable:
+        # depthwise (3, 6) conv followed by a pointwise 1x1 conv
+        return nn.Sequential(
+            nn.Conv2d(
+                in_channels,
+                in_channels,
+                kernel_size=(3, 6),
+                padding=(1, 1),
+                groups=in_channels,
+            ),
+            nn.Conv2d(in_channels, out_channels, kernel_size=1),
+        )
+    return nn.Conv2d(in_channels, out_channels, kernel_size=(3, 6), padding=(1, 1))
+
+
 class CaptchaModel(nn.Module):
-    def __init__(self, num_chars):
+    def __init__(
+        self,
+        num_chars,
+        conv_channels=(128, 64),
+        separable=False,
+        head="gru",
+        linear_size=64,
+        hidden_size=32,
+        input_channels=3,
+        input_size=(50, 160),
+        time_steps=None,
+    ):
         super(CaptchaModel, self).__init__()
-        self.conv_1 = nn.Conv2d(3, 128, kernel_size=(3, 6), padding=(1, 1))
+        if head not in ("gru", "conv"):
+            raise ValueError(f"Unknown sequence head: {head}")
+        # kept so checkpoints can rebuild the exact architecture
+        self.config = {
+            "num_chars": num_chars,
+            "conv_channels": tuple(conv_channels),
+            "separable": separable,
+            "head": head,
+            "linear_size": linear_size,
+            "hidden_size": hidden_size,
+            "input_channels": input_channels,
+            "input_size": tuple(input_size),
+            "time_steps": time_steps,
+        }
+        self.head = head
+
+        self.conv_1 = conv_block(input_channels, conv_channels[0], separable)
         self.pool_1 = nn.MaxPool2d(kernel_size=(2, 2))
-        self.conv_2 = nn.Conv2d(128, 64, kernel_size=(3, 6), padding=(1, 1))
+        self.conv_2 = conv_block(conv_channels[0], conv_channels[1], separable)
         self.pool_2 = nn.MaxPool2d(kernel_size=(2, 2))
-        self.linear_1 = nn.Linear(768, 64)
+        _, channels, height, width = self._conv_output_shape(input_channels, input_size)
+        # optionally pool the width down to fewer CTC frames
+        self.time_pool = None
+        if time_steps is not None:
+            if not 0 < time_steps <= width:
+                raise ValueError(
+                    f"time_steps must be between 1 and {width} for input size {tuple(input_size)}"
+                )
+            self.time_pool = nn.AdaptiveMaxPool2d((None, time_steps))
+            width = time_steps
+        self.sequence_length = width
+        self.linear_1 = nn.Linear(channels * height, linear_size)
         self.drop_1 = nn.Dropout(0.2)
-        # bidirectional LSTM outputs 32 features, 2 layers hence 64 in total
-        self.lstm = nn.GRU(64, 32, bidirectional=True, num_layers=2, dropout=0.25, batch_first=True)
-        self.output = nn.Linear(64, num_chars + 1)
+        if head == "gru":
+            # bidirectional GRU outputs hidden_size features per direction
+            self.lstm = nn.GRU(
+                linear_size,
+                hidden_size,
+                bidirectional=True,
+                num_layers=2,
+                dropout=0.25,
+                batch_first=True,
+            )
+        else:
+            self.temporal = nn.Sequential(
+                nn.Conv1d(linear_size, hidden_size * 2, kernel_size=3, padding=1),
+                nn.ReLU(),
+                nn.Conv1d(hidden_size * 2, hidden_size * 2, kernel_size=3, padding=1),
+                nn.ReLU(),
+            )
+        self.output = nn.Linear(hidden_size * 2, num_chars + 1)
 
-    def forward(self, images, targets=None):
-        bs, _, _, _ = images.size()
+    def _conv_features(self, images):
         x = F.relu(self.conv_1(images))
         x = self.pool_1(x)
         x = F.relu(self.conv_2(x))
         x = self.pool_2(x)
+        return x
+
+    def _conv_output_shape(self, input_channels, input_size):
+        with torch.no_grad():
+            x = self._conv_features(torch.zeros((1, input_channels, *input_size)))
+        return x.size()
+
+    def forward(self, images, targets=None, target_lengths=None):
+        bs, _, _, _ = images.size()
+        x = self._conv_features(images)
+        if self.time_pool is not None:
+            x = self.time_pool(x)
         x = x.permute(0, 3, 1, 2)
         x = x.view(bs, x.size(1), -1)
         x = F.relu(self.linear_1(x))
         x = self.drop_1(x)
-        x, _ = self.lstm(x)
+        if self.head == "gru":
+            x, _ = self.lstm(x)
+        else:
+            x = self.temporal(x.permute(0, 2, 1)).permute(0, 2, 1)
         x = self.output(x)
         x = x.permute(1, 0, 2)
 
@@ -35,9 +135,10 @@ class CaptchaModel(nn.Module):
             input_lengths = torch.full(
                 size=(bs,), fill_value=log_probs.size(0), dtype=torch.int32
             )
-            target_lengths = torch.full(
-                size=(bs,), fill_value=targets.size(1), dtype=torch.int32
-            )
+            if target_lengths is None:
+                target_lengths = torch.full(
+                    size=(bs,), fill_value=targets.size(1), dtype=torch.int32
+                )
             loss = nn.CTCLoss(blank=0)(
                 log_probs, targets, input_lengths, target_lengths
             )
@@ -46,7 +147,37 @@ class CaptchaModel(nn.Module):
         return x, None
 
 
+def check_ctc_feasibility(sequence_length, max_label_length):
+    # worst case of a label made of repeated characters, each needing a blank in between
+    if sequence_length < 2 * max_label_length + 1:
+        raise ValueError(
+            f"{sequence_length} CTC frames cannot align labels of length {max_label_length}; "
+            f"at least {2 * max_label_length + 1} are required."
+        )
+
+
+def save_checkpoint(path, model, classes, **extra):
+    torch.save(
+        {
+            "state_dict": model.state_dict(),
+            "model_config": model.config,
+            "classes": [str(c) for c in classes],
+            **extra,
+        },
+        path,
+    )
+
+
+def load_checkpoint(path, map_location="cpu"):
+    checkpoint = torch.load(path, map_location=map_location)
+    # checkpoints written before input modes existed were trained on RGB
+    checkpoint.setdefault("input_mode", "rgb")
+    model = CaptchaModel(**checkpoint["model_config"])
+    model.load_state_dict(checkpoint["state_dict"])
+    return model, checkpoint
+
+
 if __name__ == "__main__":
     cm = CaptchaModel(19)
     img = torch.rand((1, 3, 50, 160))
-    x, _ = cm(img, torch.rand((1, 5)))
\ No newline at end of file
+    x, _ = cm(img, torch.rand((1, 5)))
@@ -0,0 +1,268 @@
+import os
+import copy
+import time
+import argparse
+
+import numpy as np
+import torch
+from torch import nn
+
+import config
+import dataset
+import engine
+import train
+from model import VARIANTS, load_checkpoint
+
+
+def count_params(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def count_macs(model, input_channels=3, input_size=(50, 160)):
+    """
+    Counts multiply-accumulates of a single-image forward pass with forward
+    hooks on the conv, linear and GRU layers.
+    """
+    macs = 0
+
+    def conv_hook(module, inputs, output):
+        nonlocal macs
+        kernel_ops = int(np.prod(module.kernel_size)) * module.in_channels // module.groups
+        macs += output.numel() * kernel_ops
+
+    def linear_hook(module, inputs, output):
+        nonlocal macs
+        macs += output.numel() * module.in_features
+
+    def gru_hook(module, inputs, output):
+        nonlocal macs
+        seq_len = inputs[0].size(1) if module.batch_first else inputs[0].size(0)
+        directions = 2 if module.bidirectional else 1
+        h = module.hidden_size
+        for layer in range(module.num_layers):
+            in_size = module.input_size if layer == 0 else h * directions
+            # three gates, each with an input and a recurrent projection
+            macs += directions * seq_len * 3 * (in_size * h + h * h)
+
+    hooks = []
+    for module in model.modules():
+        if isinstance(module, (nn.Conv1d, nn.Conv2d)):
+            hooks.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, nn.Linear):
+            hooks.append(module.register_forward_hook(linear_hook))
+        elif isinstance(module, nn.GRU):
+            hooks.append(module.register_forward_hook(gru_hook))
+
+    model.eval()
+    with torch.no_grad():
+        model(torch.zeros((1, input_channels, *input_size)))
+    for hook in hooks:
+        hook.remove()
+    return macs
+
+
+def cpu_latency(model, input_channels=3, input_size=(50, 160), batch_size=1, runs=50, warmup=5):
+    """
+    :return: Median CPU latency in milliseconds of one forward pass.
+    """
+    model = model.to("cpu").eval()
+    images = torch.rand((batch_size, input_channels, *input_size))
+    timings = []
+    with torch.no_grad():
+        for i in range(warmup + runs):
+            start = time.perf_counter()
+            model(images)
+            if i >= warmup:
+                timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+
+def train_step_latency(
+    model, input_channels=3, input_size=(50, 160), batch_size=config.BATCH_SIZE, runs=20, warmup=3
+):
+    """
+    :return: Median CPU latency in milliseconds of one forward + backward +
+             optimizer step on a random batch with 5-character targets.
+    """
+    model = copy.deepcopy(model).to("cpu").train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=3e-4)
+    images = torch.rand((batch_size, input_channels, *input_size))
+    targets = torch.randint(1, model.config["num_chars"] + 1, (batch_size, 5))
+    timings = []
+    for i in range(warmup + runs):
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        _, loss = model(images, targets)
+        loss.backward()
+        optimizer.step()
+        if i >= warmup:
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+
+def validation_accuracy(model, test_records, lbl_enc, input_mode="rgb"):
+    test_loader = train.build_loader(
+        test_records,
+        shuffle=False,
+        input_mode=input_mode,
+        input_size=model.config["input_size"],
+    )
+    model.to(config.DEVICE)
+    valid_preds, _ = engine.eval_fn(model, test_loader)
+    accuracy, _ = train.captcha_accuracy(
+        valid_preds, [r["label"] for r in test_records], lbl_enc
+    )
+    return accuracy
+
+
+def preload_footprint(records, input_mode="rgb", input_size=(50, 160)):
+    # bytes the records take once preloaded into memory (config.PRELOAD_IMAGES),
+    # from one decoded image since the cache stacks same-sized uint8 arrays
+    if not records:
+        return 0
+    return len(records) * dataset.load_image(records[0]["path"], input_mode, input_size).nbytes
+
+
+def _checkpoint_mismatch(checkpoint_path, model_config, input_mode, input_size):
+    # settings of an existing checkpoint that differ from the requested ones
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    requested = {
+        **model_config,
+        "input_channels": dataset.INPUT_MODES[input_mode]["channels"],
+        "input_size": input_size,
+    }
+    saved = checkpoint["model_config"]
+    mismatch = {
+        key: (saved.get(key), value)
+        for key, value in requested.items()
+        if _as_list(saved.get(key)) != _as_list(value)
+    }
+    if checkpoint.get("input_mode", "rgb") != input_mode:
+        mismatch["input_mode"] = (checkpoint.get("input_mode", "rgb"), input_mode)
+    return mismatch
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (tuple, list)) else value
+
+
+def profile_variant(
+    name,
+    model_config,
+    checkpoint_dir,
+    epochs,
+    retrain=False,
+    input_mode=config.INPUT_MODE,
+    input_size=(config.IMAGE_HEIGHT, config.IMAGE_WIDTH),
+):
+    """
+    Trains (or reuses the checkpoint of) one architecture variant and
+    measures its cost and accuracy.
+    """
+    lbl_enc, train_records, test_records = train.load_manifest_splits()
+    checkpoint_path = os.path.join(checkpoint_dir, f"{name}.pt")
+    if os.path.exists(checkpoint_path) and not retrain:
+        mismatch = _checkpoint_mismatch(checkpoint_path, model_config, input_mode, input_size)
+        if mismatch:
+            print(f"{checkpoint_path} was trained with other settings (saved, requested): {mismatch}; retraining.")
+            retrain = True
+    if not os.path.exists(checkpoint_path) or retrain:
+        train.run_training(
+            model_config=model_config,
+            epochs=epochs,
+            model_path=checkpoint_path,
+            input_mode=input_mode,
+            input_size=input_size,
+        )
+    model, checkpoint = load_checkpoint(checkpoint_path)
+
+    input_channels = model.config["input_channels"]
+    input_size = model.config["input_size"]
+    return {
+        "variant": name,
+        "params": count_params(model),
+        "time_steps": model.sequence_length,
+        "macs": count_macs(model, input_channels, input_size),
+        "train_step_ms": train_step_latency(model, input_channels, input_size),
+        "latency_ms": cpu_latency(model, input_channels, input_size),
+        "images_per_sec": 32 / cpu_latency(model, input_channels, input_size, batch_size=32) * 1000,
+        "cache_mb": preload_footprint(train_records, checkpoint["input_mode"], input_size) / 2 ** 20,
+        "accuracy": validation_accuracy(
+            model, test_records, lbl_enc, checkpoint["input_mode"]
+        ),
+    }
+
+
+def parse_input_config(value):
+    # "gray:25x80" -> ("gray", (25, 80))
+    input_mode, size = value.split(":")
+    height, width = size.lower().split("x")
+    return input_mode, (int(height), int(width))
+
+
+def print_report(results, accuracy_bar=None):
+    print(
+        f"{'variant':<32}{'params':>10}{'T':>5}{'MMACs':>10}{'step ms':>10}{'cpu ms':>10}"
+        f"{'img/s':>10}{'cache MB':>10}{'accuracy':>10}"
+    )
+    for r in results:
+        print(
+            f"{r['variant']:<32}{r['params']:>10}{r['time_steps']:>5}{r['macs'] / 1e6:>10.2f}"
+            f"{r['train_step_ms']:>10.2f}{r['latency_ms']:>10.2f}{r['images_per_sec']:>10.1f}"
+            f"{r['cache_mb']:>10.1f}{r['accuracy']:>10.4f}"
+        )
+    if accuracy_bar is not None:
+        passing = [r for r in results if r["accuracy"] >= accuracy_bar]
+        if passing:
+            cheapest = min(passing, key=lambda r: r["macs"])
+            print(f"Cheapest variant with accuracy >= {accuracy_bar}: {cheapest['variant']}")
+        else:
+            print(f"No variant reaches accuracy {accuracy_bar}")
+
+
+if __name__ == "__main__":
+    default_input = f"{config.INPUT_MODE}:{config.IMAGE_HEIGHT}x{config.IMAGE_WIDTH}"
+    parser = argparse.ArgumentParser(description="Profile CaptchaModel variants.")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument(
+        "--input-configs",
+        nargs="+",
+        default=[default_input],
+        help="input mode and resolution pairs such as rgb:50x160 gray:25x80",
+    )
+    parser.add_argument(
+        "--time-steps",
+        nargs="+",
+        type=int,
+        default=[None],
+        help="CTC sequence lengths to pool the conv features down to",
+    )
+    parser.add_argument("--checkpoint-dir", default="checkpoints/")
+    parser.add_argument("--epochs", type=int, default=config.EPOCHS)
+    parser.add_argument("--retrain", action="store_true")
+    parser.add_argument("--accuracy-bar", type=float, default=None)
+    args = parser.parse_args()
+
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    results = []
+    for name in args.variants:
+        for input_config in args.input_configs:
+            for time_steps in args.time_steps:
+                input_mode, input_size = parse_input_config(input_config)
+                run_name = name
+                if input_config != default_input:
+                    run_name = f"{run_name}-{input_mode}-{input_size[0]}x{input_size[1]}"
+                if time_steps is not None:
+                    run_name = f"{run_name}-t{time_steps}"
+                results.append(
+                    profile_variant(
+                        run_name,
+                        {**VARIANTS[name], "time_steps": time_steps},
+                        args.checkpoint_dir,
+                        args.epochs,
+                        args.retrain,
+                        input_mode,
+                        input_size,
+                    )
+                )
+    print_report(results, args.accuracy_bar)
@@ -0,0 +1,241 @@
+import argparse
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+import config
+import engine
+import train
+from model import CaptchaModel, load_checkpoint, save_checkpoint
+from profile_models import count_macs
+
+
+def _gru_layer_outputs(gru, x):
+    """
+    Runs a multi-layer bidirectional GRU one layer at a time so the hidden
+    states of every layer, not just the last one, can be scored.
+    """
+    outputs = []
+    for layer in range(gru.num_layers):
+        single = nn.GRU(x.size(2), gru.hidden_size, bidirectional=True, batch_first=True)
+        for name in ("weight_ih", "weight_hh", "bias_ih", "bias_hh"):
+            for suffix in ("", "_reverse"):
+                getattr(single, f"{name}_l0{suffix}").data.copy_(
+                    getattr(gru, f"{name}_l{layer}{suffix}").data
+                )
+        x, _ = single(x)
+        outputs.append(x)
+    return outputs
+
+
+def channel_importance(model, images):
+    """
+    Scores conv_1/conv_2 output channels and GRU hidden units by their mean
+    absolute activation over a calibration batch.
+    :return: {"conv_1": tensor, "conv_2": tensor, "gru": [tensor per layer]}
+    """
+    if model.config["separable"]:
+        raise ValueError("Pruning supports plain conv blocks only, not separable ones.")
+
+    captured = {}
+
+    def capture(name):
+        def hook(module, inputs, output):
+            captured[name] = output
+            captured[name + "_input"] = inputs[0]
+        return hook
+
+    hooks = [
+        model.conv_1.register_forward_hook(capture("conv_1")),
+        model.conv_2.register_forward_hook(capture("conv_2")),
+    ]
+    if model.head == "gru":
+        hooks.append(model.lstm.register_forward_hook(capture("gru")))
+    model.eval()
+    with torch.no_grad():
+        model(images)
+        importance = {
+            "conv_1": F.relu(captured["conv_1"]).mean((0, 2, 3)),
+            "conv_2": F.relu(captured["conv_2"]).mean((0, 2, 3)),
+        }
+        if model.head == "gru":
+            h = model.lstm.hidden_size
+            # a unit index is shared by the forward and the reverse direction
+            importance["gru"] = [
+                out.abs().mean((0, 1)).view(2, h).sum(0)
+                for out in _gru_layer_outputs(model.lstm, captured["gru_input"])
+            ]
+    for hook in hooks:
+        hook.remove()
+    return importance
+
+
+def _keep(scores, ratio):
+    k = max(1, int(round(len(scores) * (1 - ratio))))
+    return torch.argsort(scores, descending=True)[:k].sort().values
+
+
+def prune_model(model, importance, ratio):
+    """
+    Physically removes the lowest-importance fraction `ratio` of conv_1 and
+    conv_2 channels and GRU hidden units, slicing every dependent weight.
+    :return: A new, smaller CaptchaModel.
+    """
+    model = model.to("cpu")
+    state = {k: v.clone() for k, v in model.state_dict().items()}
+    model_config = dict(model.config)
+
+    conv_1_idx = _keep(importance["conv_1"], ratio)
+    conv_2_idx = _keep(importance["conv_2"], ratio)
+    state["conv_1.weight"] = state["conv_1.weight"][conv_1_idx]
+    state["conv_1.bias"] = state["conv_1.bias"][conv_1_idx]
+    state["conv_2.weight"] = state["conv_2.weight"][conv_2_idx][:, conv_1_idx]
+    state["conv_2.bias"] = state["conv_2.bias"][conv_2_idx]
+
+    # linear_1 sees the conv output flattened as channel * height + row
+    _, _, height, _ = model._conv_output_shape(
+        model.config["input_channels"], model.config["input_size"]
+    )
+    columns = (conv_2_idx[:, None] * height + torch.arange(height)).reshape(-1)
+    state["linear_1.weight"] = state["linear_1.weight"][:, columns]
+    model_config["conv_channels"] = (len(conv_1_idx), len(conv_2_idx))
+
+    if model.head == "gru":
+        h = model.lstm.hidden_size
+        previous = None
+        for layer, scores in enumerate(importance["gru"]):
+            idx = _keep(scores, ratio)
+            # weight rows are stacked per gate (reset, update, new)
+            rows = torch.cat([gate * h + idx for gate in range(3)])
+            for suffix in ("", "_reverse"):
+                prefix = f"lstm.weight_ih_l{layer}{suffix}"
+                weight_ih = state[prefix][rows]
+                if previous is not None:
+                    weight_ih = weight_ih[:, torch.cat([previous, h + previous])]
+                state[prefix] = weight_ih
+                prefix = f"lstm.weight_hh_l{layer}{suffix}"
+                state[prefix] = state[prefix][rows][:, idx]
+                for name in ("bias_ih", "bias_hh"):
+                    prefix = f"lstm.{name}_l{layer}{suffix}"
+                    state[prefix] = state[prefix][rows]
+            previous = idx
+        state["output.weight"] = state["output.weight"][:, torch.cat([previous, h + previous])]
+        model_config["hidden_size"] = len(previous)
+
+    pruned = CaptchaModel(**model_config)
+    pruned.load_state_dict(state)
+    return pruned
+
+
+def run_pruning(
+    checkpoint_path=config.MODEL_PATH,
+    output_path="pruned.pt",
+    target_macs=0.5,
+    step_ratio=0.2,
+    finetune_epochs=2,
+    calibration_size=256,
+    max_iterations=10,
+):
+    """
+    Iterative prune -> fine-tune schedule that stops once the model's MACs
+    fall to target_macs times those of the starting checkpoint.
+    """
+    model, checkpoint = load_checkpoint(checkpoint_path)
+    input_mode = checkpoint["input_mode"]
+    input_size = model.config["input_size"]
+    input_channels = model.config["input_channels"]
+
+    lbl_enc, train_records, test_records = train.load_manifest_splits()
+    test_targets_orig = [r["label"] for r in test_records]
+    train_loader, test_loader = train.build_loaders(
+        train_records, test_records, input_mode=input_mode, input_size=input_size
+    )
+    calibration_loader = train.build_loader(
+        train_records,
+        shuffle=True,
+        batch_size=calibration_size,
+        input_mode=input_mode,
+        input_size=input_size,
+    )
+    calibration_images = next(iter(calibration_loader))["images"]
+    # only one batch is needed, shut its persistent workers down now
+    del calibration_loader
+
+    budget = count_macs(model, input_channels, input_size) * target_macs
+    macs = count_macs(model, input_channels, input_size)
+    iteration = 0
+    while macs > budget and iteration < max_iterations:
+        importance = channel_importance(model.to("cpu"), calibration_images)
+        model = prune_model(model, importance, step_ratio)
+        model.to(config.DEVICE)
+
+        optimizer = torch.optim.Adam(model.parameters(), lr=3e-4)
+        for _ in range(finetune_epochs):
+            engine.train_fn(model, train_loader, optimizer)
+        valid_preds, test_loss = engine.eval_fn(model, test_loader)
+        accuracy, _ = train.captcha_accuracy(valid_preds, test_targets_orig, lbl_enc)
+
+        macs = count_macs(model.to("cpu"), input_channels, input_size)
+        iteration += 1
+        print(
+            f"Iteration={iteration}, Channels={model.config['conv_channels']}, "
+            f"Hidden={model.config['hidden_size']}, MMACs={macs / 1e6:.2f}, "
+            f"Test Loss={test_loss} Accuracy={accuracy}"
+        )
+        save_checkpoint(
+            output_path,
+            model,
+            lbl_enc.classes_,
+            accuracy=float(accuracy),
+            input_mode=input_mode,
+        )
+
+    if iteration == 0:
+        # nothing to prune, still leave a checkpoint at output_path for the next steps
+        model.to(config.DEVICE)
+        valid_preds, test_loss = engine.eval_fn(model, test_loader)
+        accuracy, _ = train.captcha_accuracy(valid_preds, test_targets_orig, lbl_enc)
+        if macs <= budget:
+            reason = f"is already within the {budget / 1e6:.2f} MMACs budget ({macs / 1e6:.2f} MMACs)"
+        else:
+            reason = f"was not pruned, max_iterations={max_iterations}"
+        print(f"Starting model {reason}; saving it unpruned to {output_path}. Accuracy={accuracy}")
+        save_checkpoint(
+            output_path,
+            model,
+            lbl_enc.classes_,
+            accuracy=float(accuracy),
+            input_mode=input_mode,
+        )
+    elif macs > budget:
+        print(
+            f"Stopped after max_iterations={max_iterations} at {macs / 1e6:.2f} MMACs, "
+            f"above the {budget / 1e6:.2f} MMACs budget."
+        )
+
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Structured channel pruning for CaptchaModel.")
+    parser.add_argument("--checkpoint", default=config.MODEL_PATH)
+    parser.add_argument("--output", default="pruned.pt")
+    parser.add_argument("--target-macs", type=float, default=0.5,
+                        help="MAC budget as a fraction of the starting model")
+    parser.add_argument("--step-ratio", type=float, default=0.2,
+                        help="fraction of channels removed per iteration")
+    parser.add_argument("--finetune-epochs", type=int, default=2)
+    parser.add_argument("--calibration-size", type=int, default=256)
+    parser.add_argument("--max-iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    run_pruning(
+        checkpoint_path=args.checkpoint,
+        output_path=args.output,
+        target_macs=args.target_macs,
+        step_ratio=args.step_ratio,
+        finetune_epochs=args.finetune_epochs,
+        calibration_size=args.calibration_size,
+        max_iterations=args.max_iterations,
+    )
@@ -0,0 +1,322 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import sqlite3
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from sklearn import preprocessing
+
+import config
+import dataset
+import engine
+import manifest
+import train
+from model import CaptchaModel, VARIANTS
+
+# the synthesizer lives in data/ and is run as a script from there
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+from captcha_synthesis import CaptchaSynthesis  # noqa: E402
+
+MNIST_CHARS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "mnist_chars/")
+
+# synthesis knobs of CaptchaSynthesis.synthesize_captcha plus model/optimizer settings
+SEARCH_SPACE = {
+    "noise_density": [0.02, 0.05, 0.1],
+    "circle_diameter_range": [(5, 20), (5, 40), (5, 60)],
+    "rotate_range": [(-10, 10), (-20, 20), (-30, 30)],
+    "variant": ["base", "slim", "separable", "tiny"],
+    "lr": [1e-4, 3e-4, 1e-3],
+    "batch_size": [8, 16, 32],
+}
+SYNTHESIS_KEYS = ("noise_density", "circle_diameter_range", "rotate_range")
+
+
+class ArrayDataset(dataset.ClassificationDataset):
+    # images: (N, height, width, 3) uint8 RGB array, converted per input mode on access
+    def _open(self, item):
+        return Image.fromarray(self.image_paths[item])
+
+
+def labeled_array_dataset(images, labels, classes, input_mode, input_size):
+    encoded = [manifest.encode_label(label, classes) for label in labels]
+    lengths = np.array([len(e) for e in encoded])
+    targets = np.zeros((len(encoded), lengths.max()), dtype=np.int64)
+    for i, e in enumerate(encoded):
+        targets[i, : len(e)] = e
+    return ArrayDataset(
+        images, targets, resize=input_size, target_lengths=lengths, input_mode=input_mode
+    )
+
+
+def _params_key(params):
+    return hashlib.md5(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def _save_npz(path, **arrays):
+    # write-then-rename so concurrent trials never read a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def cache_validation_set(sweep_dir, input_size):
+    """
+    Decodes the manifest's test split once into a .npy file that every
+    trial memory-maps instead of decoding the images again. The file is
+    keyed by the test records and the image size, so changing either
+    builds a new one.
+    """
+    _, _, test_records = train.load_manifest_splits()
+    key = _params_key({
+        "test_records": [[r["path"], r["label"]] for r in test_records],
+        "input_size": list(input_size),
+    })
+    images_path = os.path.join(sweep_dir, f"validation_images_{key}.npy")
+    labels_path = os.path.join(sweep_dir, f"validation_labels_{key}.json")
+    if not os.path.exists(images_path):
+        images = np.stack(
+            [dataset.load_image(r["path"], "rgb", input_size) for r in test_records]
+        )
+        np.save(images_path, images)
+        with open(labels_path, "w") as f:
+            json.dump([r["label"] for r in test_records], f)
+    return images_path, labels_path
+
+
+def synthesize_training_set(sweep_dir, synthesis_params, size, input_size, seed=0):
+    """
+    Generates (or loads the cached) training images for one set of synthesis
+    knobs, so trials sharing those knobs and later rungs reuse them.
+    """
+    key = _params_key({**synthesis_params, "size": size, "seed": seed, "input_size": list(input_size)})
+    path = os.path.join(sweep_dir, f"train_{key}.npz")
+    if not os.path.exists(path):
+        synthesizer = CaptchaSynthesis(root_dir=MNIST_CHARS_DIR, seed=seed)
+        images, labels = [], []
+        for i in range(size):
+            image, label = synthesizer.synthesize_captcha(index=i, **synthesis_params)
+            images.append(dataset.load_image(image, "rgb", input_size))
+            labels.append("".join(label))
+        _save_npz(path, images=np.stack(images), labels=np.array(labels))
+    return path
+
+
+def run_trial(
+    sweep_id,
+    trial_id,
+    params,
+    epochs_done,
+    epochs_target,
+    sweep_dir,
+    train_size,
+    classes,
+    validation_paths,
+):
+    """
+    Trains one trial from its last saved state up to epochs_target epochs and
+    evaluates it on the shared validation set. Runs inside a pool worker.
+    """
+    start = time.perf_counter()
+    input_mode = config.INPUT_MODE
+    input_size = (config.IMAGE_HEIGHT, config.IMAGE_WIDTH)
+
+    synthesis_params = {k: params[k] for k in SYNTHESIS_KEYS}
+    train_data = np.load(synthesize_training_set(sweep_dir, synthesis_params, train_size, input_size))
+    images_path, labels_path = validation_paths
+    validation_images = np.load(images_path, mmap_mode="r")
+    validation_labels = json.load(open(labels_path, "r"))
+    train_loader = torch.utils.data.DataLoader(
+        labeled_array_dataset(train_data["images"], train_data["labels"], classes, input_mode, input_size),
+        batch_size=params["batch_size"],
+        shuffle=True,
+    )
+    test_loader = torch.utils.data.DataLoader(
+        labeled_array_dataset(validation_images, validation_labels, classes, input_mode, input_size),
+        batch_size=64,
+        shuffle=False,
+    )
+
+    model = CaptchaModel(
+        num_chars=len(classes),
+        input_channels=dataset.INPUT_MODES[input_mode]["channels"],
+        input_size=input_size,
+        **VARIANTS[params["variant"]],
+    )
+    model.to(config.DEVICE)
+    optimizer = torch.optim.Adam(model.parameters(), lr=params["lr"])
+    state_path = os.path.join(sweep_dir, f"trial_{sweep_id}_{trial_id}.pt")
+    if epochs_done > 0:
+        state = torch.load(state_path, map_location=config.DEVICE)
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+
+    for _ in range(epochs_target - epochs_done):
+        engine.train_fn(model, train_loader, optimizer)
+    torch.save({"model": model.state_dict(), "optimizer": optimizer.state_dict()}, state_path)
+
+    encoder = preprocessing.LabelEncoder()
+    encoder.classes_ = np.array(classes)
+    valid_preds, _ = engine.eval_fn(model, test_loader)
+    accuracy, _ = train.captcha_accuracy(valid_preds, validation_labels, encoder)
+    return trial_id, float(accuracy), time.perf_counter() - start
+
+
+def _init_worker(cpu_queue, device):
+    # pin each worker process to its own group of cores
+    cpus = cpu_queue.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(len(cpus))
+    config.DEVICE = device
+
+
+class ResultsStore:
+    # rows of every sweep run in a directory, told apart by sweep_id
+    def __init__(self, path, sweep_id):
+        self.sweep_id = sweep_id
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS trials "
+            "(sweep_id TEXT, trial_id INTEGER, params TEXT, rung INTEGER, epochs INTEGER, "
+            "accuracy REAL, seconds REAL, PRIMARY KEY (sweep_id, trial_id, rung))"
+        )
+        self._db.commit()
+
+    def record(self, trial_id, params, rung, epochs, accuracy, seconds):
+        self._db.execute(
+            "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.sweep_id, trial_id, json.dumps(params), rung, epochs, accuracy, seconds),
+        )
+        self._db.commit()
+
+    def best(self, limit=5):
+        return self._db.execute(
+            "SELECT trial_id, params, epochs, accuracy FROM trials WHERE sweep_id = ? "
+            "ORDER BY accuracy DESC, epochs DESC LIMIT ?",
+            (self.sweep_id, limit),
+        ).fetchall()
+
+
+def sample_trials(num_trials, seed=42):
+    rng = random.Random(seed)
+    return [{k: rng.choice(v) for k, v in SEARCH_SPACE.items()} for _ in range(num_trials)]
+
+
+def run_sweep(
+    num_trials=16,
+    min_epochs=1,
+    max_epochs=9,
+    eta=3,
+    workers=4,
+    train_size=2000,
+    sweep_dir="sweeps/",
+    device="cpu",
+    seed=42,
+):
+    """
+    Successive halving: every trial trains min_epochs, then only the best
+    1/eta of them continue with eta times the budget, up to max_epochs.
+    """
+    os.makedirs(sweep_dir, exist_ok=True)
+    # the trials and their budgets follow from these, so reruns with the same ones share rows
+    sweep_id = _params_key({
+        "seed": seed,
+        "search_space": SEARCH_SPACE,
+        "num_trials": num_trials,
+        "min_epochs": min_epochs,
+        "max_epochs": max_epochs,
+        "eta": eta,
+        "train_size": train_size,
+    })
+    print(f"Sweep {sweep_id}")
+    store = ResultsStore(os.path.join(sweep_dir, "results.db"), sweep_id)
+    classes = manifest.read_header(config.MANIFEST_PATH)["classes"]
+    validation_paths = cache_validation_set(sweep_dir, (config.IMAGE_HEIGHT, config.IMAGE_WIDTH))
+
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    workers = max(1, min(workers, len(cpus)))
+    cpu_queue = multiprocessing.Manager().Queue()
+    for i in range(workers):
+        cpu_queue.put(cpus[i::workers])
+
+    trials = dict(enumerate(sample_trials(num_trials, seed)))
+    epochs_done = {trial_id: 0 for trial_id in trials}
+    active = list(trials)
+    budget = min_epochs
+    rung = 0
+    trial_epochs = 0
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(cpu_queue, device)) as pool:
+        while active:
+            futures = [
+                pool.submit(
+                    run_trial,
+                    sweep_id,
+                    trial_id,
+                    trials[trial_id],
+                    epochs_done[trial_id],
+                    budget,
+                    sweep_dir,
+                    train_size,
+                    classes,
+                    validation_paths,
+                )
+                for trial_id in active
+            ]
+            scores = {}
+            for future in futures:
+                trial_id, accuracy, seconds = future.result()
+                trial_epochs += budget - epochs_done[trial_id]
+                epochs_done[trial_id] = budget
+                scores[trial_id] = accuracy
+                store.record(trial_id, trials[trial_id], rung, budget, accuracy, seconds)
+                print(f"Rung={rung}, Trial={trial_id}, Epochs={budget}, Accuracy={accuracy}, {trials[trial_id]}")
+
+            if budget >= max_epochs:
+                break
+            keep = max(1, math.ceil(len(active) / eta))
+            active = sorted(active, key=lambda t: scores[t], reverse=True)[:keep]
+            budget = min(budget * eta, max_epochs)
+            rung += 1
+
+    print(
+        f"Trained {trial_epochs} trial-epochs instead of the {num_trials * max_epochs} "
+        f"a full-length run of every trial would take."
+    )
+    return store.best()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep with successive halving.")
+    parser.add_argument("--trials", type=int, default=16)
+    parser.add_argument("--min-epochs", type=int, default=1)
+    parser.add_argument("--max-epochs", type=int, default=9)
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--train-size", type=int, default=2000)
+    parser.add_argument("--sweep-dir", default="sweeps/")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    best = run_sweep(
+        num_trials=args.trials,
+        min_epochs=args.min_epochs,
+        max_epochs=args.max_epochs,
+        eta=args.eta,
+        workers=args.workers,
+        train_size=args.train_size,
+        sweep_dir=args.sweep_dir,
+        device=args.device,
+        seed=args.seed,
+    )
+    for trial_id, params, epochs, accuracy in best:
+        print(f"Trial={trial_id}, Epochs={epochs}, Accuracy={accuracy}, {params}")
@@ -1,18 +1,18 @@
 import os
-import glob
+import time
 import torch
 import numpy as np
 
 import albumentations
 from sklearn import preprocessing
-from sklearn import model_selection
 from sklearn import metrics
 
 import config
 import dataset
 import engine
-from model import CaptchaModel
-import json
+import manifest
+from loader_tuning import autotune_loader, loader_options, make_data_loader
+from model import CaptchaModel, VARIANTS, check_ctc_feasibility, save_checkpoint
 
 from torch import nn
 
@@ -51,75 +51,146 @@ def decode_predictions(preds, encoder):
     return cap_preds
 
 
-def run_training():
-    image_files = glob.glob(os.path.join(config.DATA_DIR, "*.png"))
-    labels_dict = json.load(open(config.LABELS_DIR, 'r'))
-    targets_orig = [labels_dict[os.path.basename(x)] for x in image_files]
-    targets = [list(x) for x in targets_orig]
-    targets_flat = [c for clist in targets for c in clist]
+def load_manifest_splits(manifest_path=config.MANIFEST_PATH):
+    if not os.path.exists(manifest_path):
+        manifest.build_manifest(config.DATA_DIR, config.LABELS_DIR, manifest_path)
+    header, records = manifest.load_manifest(manifest_path)
 
-    lbl_enc = preprocessing.LabelEncoder()
-    lbl_enc.fit(targets_flat)
-    targets_enc = [lbl_enc.transform(x) for x in targets]
-    targets_enc = np.array(targets_enc)
-    targets_enc = targets_enc + 1
-
-    (
-        train_imgs,
-        test_imgs,
-        train_targets,
-        test_targets,
-        _,
-        test_targets_orig,
-    ) = model_selection.train_test_split(
-        image_files, targets_enc, targets_orig, test_size=0.1, random_state=42
+    train_records, test_records = manifest.train_test_records(
+        records, manifest_path, header["test_size"]
     )
 
-    train_dataset = dataset.ClassificationDataset(
-        image_paths=train_imgs,
-        targets=train_targets,
-        resize=(config.IMAGE_HEIGHT, config.IMAGE_WIDTH),
+    lbl_enc = preprocessing.LabelEncoder()
+    lbl_enc.classes_ = np.array(header["classes"])
+    return lbl_enc, train_records, test_records
+
+
+def records_to_targets(records):
+    # zero-pad the encoded labels (0 is the CTC blank) to a common length
+    lengths = np.array([r["length"] for r in records])
+    targets_enc = np.zeros((len(records), lengths.max()), dtype=np.int64)
+    for i, r in enumerate(records):
+        targets_enc[i, : r["length"]] = r["encoded"]
+    image_files = [r["path"] for r in records]
+    targets_orig = [r["label"] for r in records]
+    return image_files, targets_enc, lengths, targets_orig
+
+
+def build_dataset(
+    records,
+    return_index=False,
+    input_mode=config.INPUT_MODE,
+    input_size=(config.IMAGE_HEIGHT, config.IMAGE_WIDTH),
+):
+    image_files, targets_enc, lengths, _ = records_to_targets(records)
+    return dataset.ClassificationDataset(
+        image_paths=image_files,
+        targets=targets_enc,
+        resize=input_size,
+        target_lengths=lengths,
+        return_index=return_index,
+        input_mode=input_mode,
+        preload=config.PRELOAD_IMAGES,
     )
-    train_loader = torch.utils.data.DataLoader(
-        train_dataset,
-        batch_size=config.BATCH_SIZE,
-        num_workers=config.NUM_WORKERS,
-        shuffle=True,
+
+
+def build_loader(records, shuffle, batch_size=None, **kwargs):
+    # batch size and worker settings default to the autotuned ones, if any
+    options = loader_options()
+    if batch_size is None:
+        batch_size = options["batch_size"]
+    return make_data_loader(
+        build_dataset(records, **kwargs),
+        shuffle,
+        batch_size,
+        options["num_workers"],
+        options["prefetch_factor"],
     )
-    test_dataset = dataset.ClassificationDataset(
-        image_paths=test_imgs,
-        targets=test_targets,
-        resize=(config.IMAGE_HEIGHT, config.IMAGE_WIDTH),
+
+
+def build_loaders(train_records, test_records, batch_size=None, **kwargs):
+    train_loader = build_loader(train_records, shuffle=True, batch_size=batch_size, **kwargs)
+    test_loader = build_loader(test_records, shuffle=False, batch_size=batch_size, **kwargs)
+    return train_loader, test_loader
+
+
+def captcha_accuracy(valid_preds, targets_orig, encoder):
+    valid_captcha_preds = []
+    for vp in valid_preds:
+        current_preds = decode_predictions(vp, encoder)
+        valid_captcha_preds.extend(current_preds)
+    test_dup_rem = [remove_duplicates(c) for c in targets_orig]
+    accuracy = metrics.accuracy_score(test_dup_rem, valid_captcha_preds)
+    return accuracy, valid_captcha_preds
+
+
+def run_training(
+    model_config=None,
+    epochs=config.EPOCHS,
+    model_path=config.MODEL_PATH,
+    input_mode=config.INPUT_MODE,
+    input_size=(config.IMAGE_HEIGHT, config.IMAGE_WIDTH),
+):
+    if model_config is None:
+        model_config = VARIANTS[config.MODEL_VARIANT]
+    lbl_enc, train_records, test_records = load_manifest_splits()
+    test_targets_orig = [r["label"] for r in test_records]
+
+    model = CaptchaModel(
+        num_chars=len(lbl_enc.classes_),
+        input_channels=dataset.INPUT_MODES[input_mode]["channels"],
+        input_size=input_size,
+        **model_config,
     )
-    test_loader = torch.utils.data.DataLoader(
-        test_dataset,
-        batch_size=config.BATCH_SIZE,
-        num_workers=config.NUM_WORKERS,
-        shuffle=False,
+    check_ctc_feasibility(
+        model.sequence_length, max(r["length"] for r in train_records + test_records)
     )
-
-    model = CaptchaModel(num_chars=len(lbl_enc.classes_))
     model.to(config.DEVICE)
 
+    if config.AUTOTUNE_LOADER and not os.path.exists(config.LOADER_CONFIG_PATH):
+        autotune_loader(
+            build_dataset(train_records, input_mode=input_mode, input_size=input_size),
+            model,
+        )
+    train_loader, test_loader = build_loaders(
+        train_records, test_records, input_mode=input_mode, input_size=input_size
+    )
+
     optimizer = torch.optim.Adam(model.parameters(), lr=3e-4)
     scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
         optimizer, factor=0.8, patience=5, verbose=True
     )
-    for epoch in range(config.EPOCHS):
-        train_loss = engine.train_fn(model, train_loader, optimizer)
+    best_accuracy = -1.0
+    # (seconds since the start of training, accuracy) per epoch, kept in the checkpoint
+    history = []
+    training_start = time.perf_counter()
+    for epoch in range(epochs):
+        stats = {}
+        train_loss = engine.train_fn(model, train_loader, optimizer, stats=stats)
         valid_preds, test_loss = engine.eval_fn(model, test_loader)
-        valid_captcha_preds = []
-        for vp in valid_preds:
-            current_preds = decode_predictions(vp, lbl_enc)
-            valid_captcha_preds.extend(current_preds)
+        accuracy, valid_captcha_preds = captcha_accuracy(
+            valid_preds, test_targets_orig, lbl_enc
+        )
         combined = list(zip(test_targets_orig, valid_captcha_preds))
         print(combined[:10])
-        test_dup_rem = [remove_duplicates(c) for c in test_targets_orig]
-        accuracy = metrics.accuracy_score(test_dup_rem, valid_captcha_preds)
         print(
-            f"Epoch={epoch}, Train Loss={train_loss}, Test Loss={test_loss} Accuracy={accuracy}"
+            f"Epoch={epoch}, Train Loss={train_loss}, Test Loss={test_loss} Accuracy={accuracy} "
+            f"Data Stall={stats['data_time'] / stats['total_time']:.1%}"
         )
         scheduler.step(test_loss)
+        history.append((time.perf_counter() - training_start, float(accuracy)))
+        if accuracy > best_accuracy:
+            best_accuracy = accuracy
+            save_checkpoint(
+                model_path,
+                model,
+                lbl_enc.classes_,
+                accuracy=float(accuracy),
+                input_mode=input_mode,
+                history=history,
+            )
+
+    return model, best_accuracy
 
 
 if __name__ == "__main__":